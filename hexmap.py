@@ -1,663 +1,20 @@
 #!/usr/bin/env python3
+"""
+The Inkscape effect that draws a hexmap into the current document.
 
-import inkex
-import sys
-from inkex import NSS
-import math
-from lxml import etree
-
-
-class Point:
-    """
-    This class implements some simple vector algebra for cartesian coodinates
-    Several methods assume an offset from the origin to represent
-    a region with the origin at one corner.
-    """
-
-    def __init__(self, x, y):
-        """
-        Create a Point object with cartesian components
-        """
-        self.x = x
-        self.y = y
-
-    def __str__(self):
-        """
-        Convert a Point object to a string
-        """
-        return '%f,%f' % (self.x, self.y)
-
-    def __sub__(self, other):
-        """
-        Cartesian vector subtraction
-        """
-        return Point(self.x - other.x, self.y - other.y)
-
-    def __add__(self, other):
-        """
-        Cartesian vector addition
-        """
-        return Point(self.x + other.x, self.y + other.y)
-
-    def __mul__(self, k):
-        """
-        Cartesian dot-product of a vector and scalar value
-        """
-        if isinstance(k, Point):
-            return Point(self.x * k.x, self.y * k.y)
-
-        if isinstance(k, int) or isinstance(k, float):
-            return Point(self.x * k, self.y * k)
-
-        raise ValueError("point muliplier must be point or scalar")
-
-    @property
-    def swap(self):
-        """
-        Swap the X and Y coordinates
-        """
-        return Point(self.y, self.x)
-
-# ----------------------------------------------------------------------------
-# Hex Map Geometry
-# ----------------------------------------------------------------------------
+The geometry and drawing are in hexmap_core, which does not need inkex.
+"""
 
-class HexVector:
-    """
-    This class represents a single point on a hexmap or triangular tesselation
-    """
-
-    def __init__(self, hx = 0, hy = 0):
-        self._hx = hx
-        self._hy = hy
-
-    def __str__(self):
-        return "{},{}".format(self._hx, self._hy)
-
-    @property
-    def hx(self):
-        return self._hx
-
-    @property
-    def hy(self):
-        return self._hy
+import time
 
-    @property
-    def hz(self):
-        return self._hy - self._hx
-
-    @property
-    def swap(self):
-        return HexVector(self._hy, self._hx)
-
-    # comparison operators
-    def __eq__(self, other):
-        if isinstance(other, HexVector):
-            return self._hx == other.hx and self._hy == other.hy
-        return False
-
-    def __ne__(self, other):
-        if isinstance(other, HexVector):
-            return self._hx != other.hx or self._hy != other.hy
-        return True
-
-    def __add__(self, other):
-        if isinstance(other, HexVector):
-            return HexVector(self._hx + other.hx, self._hy + other.hy)
-        raise ValueError("operand of HexVector addition must be a HexVector")
-
-    def __sub__(self, other):
-        if isinstance(other, HexVector):
-            return HexVector(self._hx - other.hx, self._hy - other.hy)    
-        raise ValueError("operand of HexVector addition must be a HexVector")
-
-HexVector.ORIGIN = HexVector()
-HexVector.UNIT = [
-    HexVector(0, -1),
-    HexVector(1, 0),
-    HexVector(1, 1),
-    HexVector(0, 1),
-    HexVector(-1, 0),
-    HexVector(-1, -1)
-]
-
-
-class HexTile:
-    """
-    TBD
-    """
-
-    # Indicate the multipliers for hexrun and hexrise
-
-    _vertices = {}
-    _vertices['interior'] = [
-        Point(-2, 0),
-        Point(-1, -1),
-        Point(1, -1),
-        Point(2, 0),
-        Point(1, 1),
-        Point(-1, 1),
-        # Wrap back to close the polygon
-        Point(-2, 0)
-    ]
-    _vertices['top'] = _vertices['interior'][0:4]
-    _vertices['bottom'] = _vertices['interior'][3:7]
-    _vertices['left'] = [
-        Point(0, -1),
-        Point(1, -1),
-        Point(2, 0),
-        Point(1, 1),
-        Point(0, 1)        
-    ]
-    _vertices['right'] = [Point(-v.x, v.y) for v in _vertices['left']]
-
-    def __init__(self, center, size, side='interior'):
-        """
-        TBD
-        """
-        self._center = center
-        self._size = size
-        self._side = side
-
-    #@property
-    def vertices(self, orientation):
-        """
-        6 vertices offset from center
-        """
-        # Scale the hex vertices
-        points =  [ p * self._size for p in self._vertices[self._side]]
-
-        # Rotate the vertices for horizontal
-        if orientation == 'horizontal':
-            points = [ p.swap for p in points ]
-
-        # translate the vertices to the canvas location
-        v = [ p + self._center for p in points ]
-        
-        return v
-
-    @property
-    def label_offset(self):
-        """
-        TBD
-        """
-        if self._side in ['interior', 'top', 'bottom']:
-            offset = Point(0, (self._size.y * 0.75))
-        elif self._side == 'left':
-            offset = Point(self._size.x, 0)
-        elif self._side == 'right':
-            offset = Point(-self._size.x, 0)
-
-        return offset
-
-    @property
-    def label_center(self):
-        """
-        TBD
-        """
-
-        c = self._center
-        p = c + self.label_offset
-        return p
-        
-    def draw(self, stroke, orientation, border='solid', tic_size=0.25, dot=True):
-        """
-        Draw the complete hex
-
-        Border (solid, corners)
-        Center
-        Label
-        """
-
-        group = etree.Element('g')
-        group.set('style', 'stroke:#cccccc; stroke-width:'
-                  + str(stroke) + ';stroke-linecap:round')
-
-        v = self.vertices(orientation)
-        if border == 'solid':
-            group.append(self._polyline(v))
-        elif border == 'vertex':
-            for t in self._tics(v, tic_size):
-                group.append(t)
-            
-        # or append corners
-        # Append dots
-        if (dot and self._side in ['interior', 'top', 'bottom']):
-            c = self._center
-            group.append(self._circle(stroke, c))
-
-        return group
-
-    def _circle(self, radius, loc=None):
-        """
-        Create an SVG Circle object with the indicated size
-        """
-        circle = etree.Element('circle')
-        circle.set('r', str(radius))
-        circle.set('fill', 'black')
-
-        if loc is not None:
-            circle.set('cx', str(loc.x))
-            circle.set('cy', str(loc.y))
-        return circle
-
-    def _polyline(self, vertices):
-        """
-        TBD
-        """
-        pline = etree.Element('polyline')
-        pline.set('fill', 'none')
-        pline.set('points', ' '.join([str(p) for p in vertices]))
-        return pline
-
-    def _tics(self, vertices, tic_size=0.25):
-        """
-        Draw just corner tics for each vertex
-        """
-        # for each pair of points in the vertices list...
-        tics = []
-        for i in range(0, len(vertices) - 1):
-        
-            (start, end) = vertices[i:i+2]
-            tic = (end - start) * tic_size
-            # each pair of vertices, draw two tics, on from each vertex
-            # toward the other
-            t1 = [ start, start + tic ]
-            tics.append(self._line(t1))
-            t2 = [ end, end - tic ]
-            tics.append(self._line(t2))
-
-        return tics
-        
-    def _line(self, endpoints):
-            line = etree.Element('line')
-            (start, end) = endpoints
-            line.set('x1', str(start.x))
-            line.set('y1', str(start.y))
-            line.set('x2', str(end.x))
-            line.set('y2', str(end.y))
-
-            return line
-
-
-class BrickTile(HexTile):
-    """
-    TBD
-    """
-    _unit_vertices = [
-        Point(-2, -1),
-        Point(2, -1),
-        Point(2, 1),
-        Point(-2, -1)
-    ]
-
-
-class SquareTile(BrickTile):
-    """
-    TBD
-    """
-    _height_ratio = 1
-
-
-class HexLabel:
-    """
-    This class represents and draws a hex coordinate label
-    """
-
-    def __init__(self, hextile, edge='interior'):
-        self._hextile = hextile
-        self._edge = edge
-
-    def draw(self, loc, font_size, anchor='middle'):
-        label = etree.Element('text')
-
-        label.text = str(self._hextile)
-
-        # Set the fond and drawing characteristics
-        style = ('text-align:center;text-anchor:%s;font-size:%fpt'
-                 % (anchor, font_size))
-        label.set('style', style)
-
-        label.set('x', str(loc.x))
-        label.set('y', str(loc.y))
-
-        return label
-
-# ============================================================================
-# Grid classes
-#   These generate a list of hexes in a specified shape
-# ============================================================================
-class RadialHexGrid:
-    """
-    TBD
-    """
-
-    def __init__(self, size, origin=HexVector.ORIGIN):
-        """
-        TBD
-        """
-        self._size = size
-
-    @property
-    def _radius(self):
-        """
-        The radius of a radial hexgrid is the length of the size vector
-        """
-        return max(abs(self._size.hx), abs(self._size.hy))
-
-    def column(self,hx):
-        """
-        Produce a list of the hexes in the indicated column
-        """
-        # column 0
-        radius = self._radius
-        min = -radius if hx < 0 else -radius + hx
-        max = radius if hx > 0 else radius - hx
-        for hy in range(min, max + 1):
-            yield HexVector(hx, hy) + self._origin
-
-    @property
-    def hexes(self):
-        """
-        Produce a list of hexes in a radial map, column by column
-        """
-        # column 0
-        radius = self._radius
-        for hx in range(-radius, radius + 1):
-            # A radial hex map is a truncated parallelogram
-            min = -radius if hx < 0 else -radius + hx
-            max = radius if hx > 0 else radius - hx
-            for hy in range(min, max + 1):
-                yield HexVector(hx, hy) + self._origin
-
-class RectangularHexGrid(RadialHexGrid):
-    """
-    TBD
-    """
-
-    def _ybias(self, hx):
-        """
-        """
-        return self.hx % 2
-
-    def column(self,hx):
-        """
-        TBD
-        """
-        min = self._ybias
-        for hy in range(min, min + self._size.hy):
-            yield HexVector(hx, hy) + self._origin
-
-    @property
-    def hexes(self):
-        """
-        """
-        for hx in range(0, self._size.hx):
-            min = self._ybias
-            for hy in range(min, min + self._size.hy):
-                yield HexVector(hx, hy) + self._origin
-
-
-# ============================================================================
-# Combined grid and placement classes
-# ============================================================================
-class HexGridRectangle:
-    """
-    This class represents the descrete locations on a hexmap
-    """
-
-    def __init__(self, size, origin=HexVector.ORIGIN, shift=False):
-        """
-        TBD
-        """
-        self._size = size
-        self._origin = origin
-        self._shift = shift
-
-    @property
-    def size(self):
-        return self._size
-
-    @property
-    def origin(self):
-        return self._origin
-    
-    @property
-    def hexes(self):
-        """
-        A generator that iterates over all of the hexes in the map
-        """
-        for col in range(0, self._size.hx):
-            for row in range(0, self._size.hy):
-                #location = HexVector(col, row
-                yield HexVector(col, row) + self._origin
-
-    def translate(self, hexloc):
-        """
-        Convert the hex location to units of hexrun and hexrise
-        """
-        # triangle
-        #return Point(hexloc.hx, hexloc.hy - (hexloc.hx / 2))
-        return Point(hexloc.hx, hexloc.hy - ((hexloc.hx % 2)/2))
-
-    def ybias(self, col):
-        """
-        Adjust the set of rows to create a rectangular grid for drawing
-        """
-        # Adjust so negative columns are properly shifted
-        c = col if col >= 0 else col - 1
-        return int(c / 2)
-    
-    def edge(self, hexloc):
-        """
-        Determine if the hex is on an edge and if so, which one?
-        """
-
-        if self._shift is False:
-            return 'interior'
-
-        if (hexloc.hx - self._origin.hx) == 0:
-            return 'left'
-        elif self._size.hx - (hexloc.hx - self._origin.hx) == 1:
-            return 'right'
-
-        if (hexloc.hy - self._origin.hy) == 0:
-            return 'top'
-        elif self._size.hy - (hexloc.hy - self._origin.hy) == 1:
-            return 'bottom'
-
-        return 'interior'
-
-class HexGridTriangle(HexGridRectangle):
-    """
-    TBD
-    """
-
-    @property
-    def hexes(self):
-        """
-        A generator that iterates over all of the hexes in the map
-        """
-        for col in range(0, self._size.hx):
-            ybias = self.ybias(col)
-            for row in range(ybias, self._size.hy + ybias):
-                yield HexVector(col, row) + self._origin
-
-    def translate(self, hexloc):
-        """
-        Convert the hex location to units of hexrun and hexrise
-        """
-        # triangle
-        return Point(hexloc.hx, hexloc.hy - (hexloc.hx /2))
-    
-
-class HexGridHerringbone(HexGridRectangle):
-    @property
-    def hexes(self):
-        """
-        A generator that iterates over all of the hexes in the map
-        """
-        col_start = self._origin.hx - int(self._size.hx / 2)
-        col_end = col_start + self._size.hx
-        for col in range(col_start, col_end):
-            
-            ybias = self.ybias(col)
-            for row in range(ybias, self._size.hy + ybias):
-                yield HexVector(col+row, row)
-
-    def translate(self, hexloc):
-        """
-        Convert the hex location to units of hexrun and hexrise
-        """
-        # herringbone
-        return Point(hexloc.hx - hexloc.hy, hexloc.hy + hexloc.hz/2)
-
-
-class HexCanvas:
-    """
-    Draw the tiles on the SVG document
-    """
-
-    def __init__(self, svg, map_spec):
-        """
-        Store and initialize the elements to draw the map
-        """
-        self._svg = svg
-        self._spec = map_spec
-
-    @property
-    def size(self):
-        """
-        Return the size of the svg canvas as a Point object
-        """
-        unit = self._svg.unittouu
-        size = Point(float(unit(self._svg.get('width'))),
-                     float(unit(self._svg.get('height'))))
-        if self._spec['orientation'] == 'horizontal':
-            size = size.swap
-        return size
-
-    @property
-    def grid(self):
-        return self._spec['grid']
-
-    @property
-    def stroke_width(self):
-        """
-        The width of lines drawn for borders and vertices.
-        A percentage of the total width or height of a hex
-        """
-        csize = self.size
-        # Define the stroke width as a percentage of the size of one hex
-        if self._spec['orientation'] == 'vertical':
-            return (self._spec['stroke_width'] / self.grid.size.hx) * csize.x
-        else:
-            return (self._spec['stroke_width'] / self.grid.size.hy) * csize.y
-            
-    @property
-    def tile_size(self):
-        """
-        Determine the hexrise and hexrun dimensions of a hex by fitting
-        a hexgrid into the canvas dimensions.
-        Hexes pack so that the columns are only 3/4 as wide as one hex
-        dim.x = hexrun = hexside / 2 = hexwidth / 4
-        dim.y = hexrise = hexheight / 2
-        """
-        # TODO - Adjust for brick and square tiles
-        csize = self.size
-
-        # hexrun is the basic dimension of a hex
-        # it is 1/2 of a hexside and 1/4 of the longest 'diameter' of a hex
-        if self._spec['wrap_x']:
-            hexrun = csize.x / ((self.grid.size.hx - 1) * 3)
-        else:
-            hexrun = (csize.x - self.stroke_width) / ((self.grid.size.hx * 3) + 1)
-
-        # The height of a hex is cos(pi/6) * the width
-        # hexrise is 1/2 of a hex height
-        hexrise = (hexrun * 2) * 0.8660254
-
-        # TODO - check the canvas y as well and pick the smallest dimension
-        #        that allows the entire hexgrid to pack within the canvas
-        if hexrise * ((self.grid.size.hy * 2) + 1) > csize.y:
-            hexrise = (csize.y - self.stroke_width) / ((self.grid.size.hy * 2) + 1)
-            hexrun = hexrise / ( 2 * 0.8660254 )
-
-        return Point(hexrun, hexrise)
-
-    @property
-    def padding(self):
-        """
-        Determine how much space exists on the page outside the boundaries
-        of the hex grid
-        """
-        tdim = self.tile_size
-        if self._spec['wrap_x'] is False:
-            msize = Point(tdim.x * ((self.grid.size.hx * 3) + 1),
-                          tdim.y * ((self.grid.size.hy * 2) + 1))
-
-        else:
-            msize = Point(tdim.x * ((self.grid.size.hx - 1) * 3),
-                          tdim.y * ((self.grid.size.hy * 2) + 1))
-
-        s = self.size
-        excess = (s - msize)
-        pad = Point(excess.x / 2, excess.y / 2)
-
-        return pad
-
-    @property
-    def tile_origin(self):
-        """
-        Find the center point of the origin tile on the canvas
-        """
-        dim = self.tile_size
-
-        # offset to center the map on the page
-        offset_x = 0 if self._spec['wrap_x'] else dim.x * 2
-        origin = Point(offset_x, dim.y * 2) + Point(self.stroke_width/2, self.stroke_width/2)
-        if self._spec['pad']:
-            origin += self.padding
-        return origin
+import inkex
 
+from hexmap_core import (NSS, HexCanvas, HexVector, append_if_new_name,
+                         createLayer, define_clip, draw_map,
+                         find_or_create_defs, grid_geometries, make_grid,
+                         make_label_spec, output_format, output_styles,
+                         phase_timer, update_children)
 
-    @property
-    def tile_step(self):
-        """
-        This a vector where the two coordinates correspond to the
-        horizontal and vertical distance between one hex and the next in
-        each dimension
-        """
-        return self.tile_size * Point(3, 2)
-
-    def tile_center(self, hexloc):
-        """
-        Find the center point of a tile on the grid
-        Multiply the hexloc coords by the tile_step and add the tile_origin
-        """
-        # Convert the hexvector to a point
-        normalized = hexloc - self.grid.origin
-        c = self.tile_origin + (self.grid.translate(normalized) * self.tile_step)
-        if self._spec['orientation'] == 'horizontal':
-            c = c.swap
-        return c
-
-# -------------------------------------------------------------------------
-# Layer creation and management
-# -------------------------------------------------------------------------
-
-def append_if_new_name(svg, layer):
-    if layer is not None:
-        name = layer.get(inkex.addNS('label', 'inkscape'))
-        if not name in [c.get(inkex.addNS('label', 'inkscape'), 'name')
-                        for c in svg.iterchildren()]:
-            svg.append(layer)
-
-def createLayer(name):
-    layer = etree.Element(inkex.addNS('g', 'svg'))
-    layer.set(inkex.addNS('label', 'inkscape'), name)
-    layer.set(inkex.addNS('groupmode', 'inkscape'), 'layer')
-    return layer
 
 # ----------------------------------------------------------------------------
 # Inkscape Hexmap Drawing
@@ -685,8 +42,52 @@ class HexmapEffect(inkex.Effect):
         draw_parser.add_argument("--units", default='mm',
                                  help="Units this dialog is using")
         # Hex size is calculated by default
-        draw_parser.add_argument('--hexsize', type = float, default = 0.0)
+        draw_parser.add_argument('--hexsize', type = float, default = 0.0,
+                                 help = 'Width of a hex in units, or 0 to fit the map to the page')
+        draw_parser.add_argument('--window-col', type = int, default = 0,
+                                 dest = 'window_col',
+                                 help = 'First column at the left of the page')
+        draw_parser.add_argument('--window-row', type = int, default = 0,
+                                 dest = 'window_row',
+                                 help = 'First row at the top of the page')
+        draw_parser.add_argument('--clip', type = inkex.Boolean,
+                                 default = False,
+                                 help = 'Clip tiles that are partly off the page')
+        draw_parser.add_argument('--chunk-cols', type = int, default = 0,
+                                 dest = 'chunk_cols',
+                                 help = 'Columns in each sub-layer, or 0 for all')
+        draw_parser.add_argument('--chunk-rows', type = int, default = 0,
+                                 dest = 'chunk_rows',
+                                 help = 'Rows in each sub-layer, or 0 for all')
+        draw_parser.add_argument('--jobs', type = int, default = 1,
+                                 help = 'Processes drawing the tiles in parallel')
         draw_parser.add_argument('--strokewidth', type = float, default = 2.5)
+        draw_parser.add_argument('--precision', type = int, default = 6,
+                                 help = 'Decimal places in coordinates')
+        draw_parser.add_argument('--relative-paths', type = inkex.Boolean,
+                                 default = False,
+                                 help = 'Write path coordinates relative to the previous point')
+        draw_parser.add_argument('--style-classes', type = inkex.Boolean,
+                                 default = False,
+                                 help = 'Share styles as CSS classes instead of inline styles')
+        draw_parser.add_argument('--update', type = inkex.Boolean,
+                                 default = False,
+                                 help = 'Only change the parts of an existing hexmap layer that differ')
+
+        # Profiling
+        profile_parser = self.arg_parser.add_argument_group("profiling")
+        profile_parser.add_argument('--profile', type = inkex.Boolean,
+                                    default = False,
+                                    help = 'Report the time taken by each phase as JSON')
+        profile_parser.add_argument('--profile-output', default = '-',
+                                    dest = 'profile_output',
+                                    help = 'File for the report, or - for stderr')
+        profile_parser.add_argument('--profile-stats', default = '',
+                                    dest = 'profile_stats',
+                                    help = 'File for a cProfile dump of the run')
+        profile_parser.add_argument('--profile-memory', type = inkex.Boolean,
+                                    default = False, dest = 'profile_memory',
+                                    help = 'Report the peak memory traced by tracemalloc')
 
         # Label Spec and Layout
         self._add_label_parser()
@@ -696,22 +97,14 @@ class HexmapEffect(inkex.Effect):
 # Argument Parser Groups
 # -----------------------------------------------------------------------------
 
-    _grids = {
-        'rectangle': HexGridRectangle,
-        'triangle': HexGridTriangle,
-        'herringbone': HexGridHerringbone
-    }
+    _grids = grid_geometries
 
     @property
     def map_spec(self):
         """
         Collect the map parameters for easy access
         """
-        # TBD - check the value of the grid selection
-        grid = HexmapEffect._grids[self.options.geometry](
-            HexVector(self.options.size_hx, self.options.size_hy),
-            HexVector(self.options.origin_hx,self.options.origin_hy),
-            self.options.wrap_x)
+        grid = self.grid
 
         spec = {
             'geometry': self.options.geometry,
@@ -724,6 +117,8 @@ class HexmapEffect(inkex.Effect):
             'tic_size': self.options.tic_size / 200,  # 1/2 of a percentage
             'center_dot': self.options.center_dot,
             'label': self.options.label,
+            'label_mode': self.options.label_mode,
+            'output_mode': self.options.output_mode,
             'wrap_x': self.options.wrap_x,
             'wrap_y': self.options.wrap_y,
             'reverse_x': False,
@@ -731,7 +126,18 @@ class HexmapEffect(inkex.Effect):
             'sawtooth': self.options.sawtooth,
             # drawing spec
             'units': self.options.units,
-            'stroke_width': self.options.strokewidth / 100.0
+            'stroke_width': self.options.strokewidth / 100.0,
+            'precision': self.options.precision,
+            'relative_paths': self.options.relative_paths,
+            'style_classes': self.options.style_classes,
+            'window_col': self.options.window_col,
+            'window_row': self.options.window_row,
+            'clip': self.options.clip,
+            'chunk_cols': self.options.chunk_cols,
+            'chunk_rows': self.options.chunk_rows,
+            'jobs': self.options.jobs,
+            'megahex': self.options.megahex,
+            'label_spec': make_label_spec(self.label_params, grid.size)
         }
 
         return spec
@@ -742,7 +148,8 @@ class HexmapEffect(inkex.Effect):
         """
         map_parser = self.arg_parser.add_argument_group("map parameters")
         map_parser.add_argument('--geometry',
-                                choices = ['rectangle', 'triangle', 'herringbone'],
+                                choices = ['rectangle', 'triangle', 'herringbone',
+                                           'radial'],
                                 default = 'rectangle',
                                 help = "Hexmap Coordinate System")
         map_parser.add_argument('--size-hx', type = int, default = '10',
@@ -774,7 +181,7 @@ class HexmapEffect(inkex.Effect):
                                 help = 'number rows from bottom to top')
         map_parser.add_argument('--sawtooth', type = inkex.Boolean,
                                 default = False, dest='sawtooth',
-                                help = 'First column half-hex down')
+                                help = 'First column half-hex up')
         map_parser.add_argument('--halfhexes', type = inkex.Boolean,
                                 default = False)
         map_parser.add_argument('--tileshape',
@@ -782,49 +189,67 @@ class HexmapEffect(inkex.Effect):
                                 default = 'hex',
                                 help = 'The shape for each tile in the map')
         map_parser.add_argument('--border-style',
-                                choices = ['solid', 'vertex', 'none'],
+                                choices = ['solid', 'shared', 'vertex',
+                                           'shared-vertex', 'none'],
                                 default = 'solid',
-                                help = 'How to draw the hex border: solid or vertices')
+                                help = 'How to draw the hex border: solid, shared edges, vertices or shared vertices')
         map_parser.add_argument('--tic-size', type = int, default = '25',
                                 help = 'Size of corner tics in % of side')
+        map_parser.add_argument('--megahex', type = int, default = 0,
+                                help = 'Radius of the megahexes outlined over the map, or 0 for none')
         map_parser.add_argument('--center-dot', type = inkex.Boolean,
                                 default = True,
                                 help = "Draw a dot at the center of each hex")
         map_parser.add_argument('--label', type = inkex.Boolean,
                                 default = True,
                                 help = "Label each hex")
+        map_parser.add_argument('--label-mode',
+                                choices = ['text', 'column', 'single'],
+                                default = 'text',
+                                help = 'One text element per hex, per column or for the whole map')
+        map_parser.add_argument('--output-mode',
+                                choices = ['tiles', 'path', 'symbol', 'pattern'],
+                                default = 'tiles',
+                                help = 'Draw a group per tile, one path for the whole grid, one symbol per tile shape or a repeating pattern')
     @property
-    def label_spec(self):
+    def grid(self):
         """
-        Collect label parameters for easy access
+        The grid for the selected geometry
         """
-        # determine the size of the label component fields
-        hxdigits = nrdigits(self.options.size_hx + self.options.coordcolstart)
-        hydigits = nrdigits(self.options.size_hy + self.options.coordrowstart)
-        if hxdigits < 2:
-            hxdigits = 2
-        if hydigits < 2:
-            hydigits = 2
-        if self.coordrowfirst:
-            hxdigits,hydigits = [hydigits,hxdigits]
+        return make_grid(
+            self.options.geometry,
+            HexVector(self.options.size_hx, self.options.size_hy),
+            HexVector(self.options.origin_hx,self.options.origin_hy),
+            self.options.wrap_x, self.options.sawtooth)
 
-        spec = {
+    @property
+    def label_params(self):
+        """
+        Collect label parameters for easy access
+        """
+        return {
             'seperator': self.options.coordseparator,
             'alphacolumn': self.options.coordalphacol,
             'zeropad': self.options.coordzeros,
             'invert': self.options.coordrowfirst,
-            'hxdigits': hxdigits,
-            'hydigits': hydigits
+            'reverse_row': self.options.label_reverse_y,
+            'colstart': self.options.coordcolstart,
+            'rowstart': self.options.coordrowstart
         }
 
-        return spec
+    @property
+    def label_spec(self):
+        """
+        The label parameters with the size of the label component fields
+        """
+        return make_label_spec(self.label_params, self.grid.size)
 
     def _add_label_parser(self):
         """
         Add hex label arguments
         """
         label_parser = self.arg_parser.add_argument_group("label parameters")
-        label_parser.add_argument('--coordcolstart', type = int, default = '0')
+        label_parser.add_argument('--coordcolstart', type = int, default = '1')
         label_parser.add_argument('--coordrowstart', type = int, default = '0')
         label_parser.add_argument('--coordrows', type = int, default = '1')
         label_parser.add_argument('--coordseparator', type = str, default = ',')
@@ -842,6 +267,50 @@ class HexmapEffect(inkex.Effect):
                                   help = 'Row coordinate first in a label')
 
 
+# ----------------------------------------------------------------------------
+# Profiling the phases of a run
+# ----------------------------------------------------------------------------
+
+    def parse_arguments(self, args):
+        start = time.perf_counter()
+        inkex.Effect.parse_arguments(self, args)
+        self._profiler = None
+        phase_timer.configure(self.options.profile)
+        if not self.options.profile:
+            return
+        phase_timer.add('arguments', time.perf_counter() - start)
+
+        if self.options.profile_memory:
+            import tracemalloc
+            tracemalloc.start()
+        if self.options.profile_stats:
+            import cProfile
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+
+    def load_raw(self):
+        with phase_timer.phase('load'):
+            inkex.Effect.load_raw(self)
+
+    def save_raw(self, ret):
+        with phase_timer.phase('serialize'):
+            inkex.Effect.save_raw(self, ret)
+
+    def clean_up(self):
+        if phase_timer.enabled:
+            extra = {}
+            if self._profiler is not None:
+                self._profiler.disable()
+                self._profiler.dump_stats(self.options.profile_stats)
+                extra['stats'] = self.options.profile_stats
+            if self.options.profile_memory:
+                import tracemalloc
+                extra['peak_memory_bytes'] = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+            phase_timer.write(self.options.profile_output, **extra)
+            phase_timer.configure()
+        inkex.Effect.clean_up(self)
+
 # ----------------------------------------------------------------------------
 # The 'main' method for drawing the map
 # ----------------------------------------------------------------------------
@@ -851,42 +320,45 @@ class HexmapEffect(inkex.Effect):
         # Define some local references to shorten later lines
 
         svg = self.document.xpath('//svg:svg' , namespaces=NSS)[0]
-        layer = createLayer('hexmap')
-        append_if_new_name(svg, layer)
-        
-        hexcanvas = HexCanvas(svg, self.map_spec)
-
-        # --------------------------------------------------------------------
-        #
-        # --------------------------------------------------------------------
-
-        tilesize = hexcanvas.tile_size
-        tilestep = hexcanvas.tile_step
-
-        # draw all of the hexes in the grid
-        for hexloc in hexcanvas.grid.hexes:
-            
-            center = hexcanvas.tile_center(hexloc)
-
-            #if shift:
-            edge = hexcanvas.grid.edge(hexloc)
-            # else: edge = 'interior'
-
-            tile = HexTile(center, tilesize, edge)
-            layer.append(tile.draw(
-                hexcanvas.stroke_width,
-                hexcanvas._spec['orientation'],
-                hexcanvas._spec['border_style'],
-                hexcanvas._spec['tic_size'],
-                hexcanvas._spec['center_dot']
-            ))
-            if self.options.label:
-                label = HexLabel(hexloc, edge)
-                layer.append(label.draw(tile.label_center, tilesize.y/5))
+        layer = append_if_new_name(svg, createLayer('hexmap'))
+
+        with phase_timer.phase('map_spec'):
+            map_spec = self.map_spec
+        with phase_timer.phase('layout'):
+            hexcanvas = HexCanvas(svg, map_spec)
+            hexcanvas.layout
+
+        spec = hexcanvas._spec
+        output_format.configure(spec['precision'], spec['relative_paths'])
+        output_styles.configure(spec['style_classes'])
+
+        defs = None
+        if (spec['output_mode'] in ['symbol', 'pattern']
+                or spec['style_classes'] or spec['clip']):
+            defs = find_or_create_defs(svg)
+
+        with phase_timer.phase('drawing'):
+            if spec['clip']:
+                layer.set('clip-path', define_clip(defs, hexcanvas.layout))
+            elif layer.get('clip-path') is not None:
+                del layer.attrib['clip-path']
+
+            elements = draw_map(hexcanvas.layout, spec, defs)
+            if self.options.update:
+                update_children(layer, elements)
+            else:
+                for child in list(layer):
+                    layer.remove(child)
+                # inkex reads the new elements twice
+                layer.extend(list(elements))
+
+            if spec['style_classes']:
+                output_styles.define(defs)
 
 # ============================================================================
 #
 # After defining everything, make it go
 #
 # ============================================================================
-HexmapEffect().run()
+if __name__ == '__main__':
+    HexmapEffect().run()
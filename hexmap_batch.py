@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""
+Render many hexmaps outside of Inkscape.
+
+The maps are listed in a JSON file, as a list of objects, or in a CSV
+file with one map per row. The keys are the map_spec keys with the grid
+given as size_hx, size_hy, origin_hx and origin_hy (see
+hexmap_core.map_defaults), and the label_spec keys (see
+hexmap_core.label_defaults). Three more keys describe the output
+document:
+
+  output  the file name of the SVG (default hexmap-NNN.svg)
+  width   the page width in units (default 210)
+  height  the page height in units (default 297)
+
+Each map is written to its own file by a pool of worker processes, and
+the time taken for each one is reported as it finishes. A map that
+fails is reported with its error and the rest of the batch carries on,
+with a non-zero exit status at the end. A map with
+chunk_files set is written as one file per region of chunk_cols by
+chunk_rows hexes, named after the output file.
+"""
+
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import hexmap_core
+
+
+page_defaults = {
+    'width': 210.0,
+    'height': 297.0
+}
+
+def convert(key, value, defaults):
+    """
+    Convert a CSV string to the type of the default value for the key
+    """
+    default = defaults.get(key)
+    if isinstance(default, bool):
+        return value.strip().lower() in ['true', 'yes', '1']
+    if isinstance(default, int):
+        return int(value)
+    if isinstance(default, float):
+        return float(value)
+    return value
+
+def read_maps(filename):
+    """
+    Read the list of map parameters from a JSON or CSV file
+    """
+    with open(filename, newline='') as f:
+        if filename.endswith('.csv'):
+            defaults = dict(hexmap_core.map_defaults,
+                            **hexmap_core.label_defaults)
+            defaults.update(page_defaults)
+            return [{k: convert(k, v, defaults) for (k, v) in row.items()
+                     if v != ''}
+                    for row in csv.DictReader(f)]
+        return json.load(f)
+
+def render(params, outdir):
+    """
+    Render one map to its SVG file and report how long it took
+    """
+    params = dict(params)
+    output = os.path.join(outdir, params.pop('output'))
+    width = params.pop('width', page_defaults['width'])
+    height = params.pop('height', page_defaults['height'])
+
+    start = time.perf_counter()
+    spec = hexmap_core.make_map_spec(params)
+    if spec['chunk_files']:
+        files = hexmap_core.write_hexmap_regions(output, spec, width,
+                                                 height, spec['units'])
+    else:
+        with open(output, 'wb') as f:
+            hexmap_core.write_hexmap(f, spec, width, height, spec['units'])
+        files = [output]
+    elapsed = time.perf_counter() - start
+
+    return {
+        'output': output,
+        'hexes': len(spec['grid']),
+        'seconds': elapsed,
+        'bytes': sum(os.path.getsize(f) for f in files)
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('maps', help='JSON or CSV file listing the maps')
+    parser.add_argument('--outdir', default='.',
+                        help='Directory for the SVG files')
+    parser.add_argument('--jobs', type=int, default=None,
+                        help='Number of worker processes (default: all CPUs)')
+    args = parser.parse_args(argv)
+
+    maps = read_maps(args.maps)
+    for (n, params) in enumerate(maps):
+        params.setdefault('output', 'hexmap-%03d.svg' % n)
+
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=args.jobs) as pool:
+        jobs = {pool.submit(render, params, args.outdir):
+                os.path.join(args.outdir, params['output'])
+                for params in maps}
+        failed = 0
+        for job in as_completed(jobs):
+            try:
+                result = job.result()
+            except Exception as e:
+                # One bad map doesn't stop the rest of the batch
+                failed += 1
+                sys.stderr.write('%s: failed: %s: %s\n'
+                                 % (jobs[job], type(e).__name__, e))
+                continue
+            print('%(output)s: %(hexes)d hexes, %(bytes)d bytes, '
+                  '%(seconds).3fs' % result)
+    print('%d maps in %.3fs' % (len(maps), time.perf_counter() - start))
+    if failed:
+        sys.stderr.write('%d of %d maps failed\n' % (failed, len(maps)))
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+"""
+Measure how long hexmaps take to draw and how large they are.
+
+Every combination of the chosen geometries, sizes, border styles, center
+dots and labels is drawn once per repeat. For each one the report has
+the best wall time, the peak memory while drawing, the number of SVG
+elements and the size of the output. The report is JSON so that runs
+before and after a change can be compared with --compare.
+
+By default the maps are written with the headless writer
+(hexmap_core.write_hexmap). With --effect they are drawn by HexmapEffect
+into a blank Inkscape document instead.
+
+The report also has the cold start time of each module: how long a new
+Python process takes to import it, less the time to start Python.
+"""
+
+import argparse
+import io
+import itertools
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from lxml import etree
+
+import hexmap_core
+
+
+# The modules timed from a cold start
+startup_modules = ['hexmap_core', 'hexmap']
+
+# The page the maps are fitted to, in mm
+page_size = (210.0, 297.0)
+
+blank_document = (
+    '<svg xmlns="http://www.w3.org/2000/svg" width="%smm" height="%smm" '
+    'viewBox="0 0 %s %s" version="1.1"/>' % (page_size * 2))
+
+sweep_defaults = {
+    'geometry': ['rectangle', 'triangle', 'herringbone'],
+    'size': [10, 50, 100, 250, 500],
+    'border_style': ['solid', 'shared', 'vertex', 'shared-vertex', 'none'],
+    'center_dot': [True, False],
+    'label': [True, False]
+}
+
+def cases(sweep):
+    """
+    The map parameters for every combination in the sweep
+    """
+    keys = list(sweep_defaults)
+    for values in itertools.product(*[sweep[k] for k in keys]):
+        params = dict(zip(keys, values))
+        size = params.pop('size')
+        params['size_hx'] = size
+        params['size_hy'] = size
+        yield params
+
+def write_headless(params):
+    """
+    Draw a map with the streaming writer and return the document
+    """
+    spec = hexmap_core.make_map_spec(params)
+    output = io.BytesIO()
+    hexmap_core.write_hexmap(output, spec, *page_size)
+    return output.getvalue()
+
+def effect_arguments(params):
+    """
+    The command line of the Inkscape effect for the map parameters
+    """
+    return ['--geometry=%s' % params['geometry'],
+            '--size-hx=%d' % params['size_hx'],
+            '--size-hy=%d' % params['size_hy'],
+            '--border-style=%s' % params['border_style'],
+            '--center-dot=%s' % params['center_dot'],
+            '--label=%s' % params['label']]
+
+def write_effect(params, document):
+    """
+    Draw a map with the Inkscape effect into a blank document and return
+    the result
+    """
+    import hexmap
+
+    output = io.BytesIO()
+    hexmap.HexmapEffect().run(effect_arguments(params) + [document],
+                              output=output)
+    return output.getvalue()
+
+def measure(draw, params, repeat):
+    """
+    Time the best of repeat runs, then measure the peak memory of one
+    more. Tracing memory slows Python down, so it is kept out of the
+    timed runs.
+    """
+    seconds = None
+    for n in range(repeat):
+        start = time.perf_counter()
+        document = draw(params)
+        elapsed = time.perf_counter() - start
+        seconds = elapsed if seconds is None else min(seconds, elapsed)
+
+    tracemalloc.start()
+    draw(params)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    elements = sum(1 for (event, element) in
+                   etree.iterparse(io.BytesIO(document), events=('start',)))
+    return {
+        'seconds': seconds,
+        'peak_bytes': peak,
+        'elements': elements,
+        'output_bytes': len(document)
+    }
+
+def python_seconds(code, repeat):
+    """
+    The best time of repeat new Python processes running the code
+    """
+    directory = os.path.dirname(os.path.abspath(__file__))
+    seconds = None
+    for n in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, '-c', code], cwd=directory,
+                       check=True)
+        elapsed = time.perf_counter() - start
+        seconds = elapsed if seconds is None else min(seconds, elapsed)
+    return seconds
+
+def measure_startup(modules, repeat):
+    """
+    The cold start time of each module, less the time to start Python
+    """
+    python = python_seconds('pass', repeat)
+    return {module: python_seconds('import ' + module, repeat) - python
+            for module in modules}
+
+def boolean(value):
+    return value.strip().lower() in ['true', 'yes', '1']
+
+def case_key(result):
+    return tuple(result[k] for k in ['geometry', 'size_hx', 'border_style',
+                                     'center_dot', 'label'])
+
+def compare(results, startup, baseline):
+    """
+    Print the ratio of each measurement to the same case in the
+    baseline. They go to stderr with the progress, away from the report.
+    """
+    for (module, seconds) in startup.items():
+        old = baseline.get('startup', {}).get(module)
+        if old:
+            print('import %s: %.2f' % (module, seconds / old),
+                  file=sys.stderr)
+    before = {case_key(r): r for r in baseline['results']}
+    print('%-12s %5s %-7s %-5s %-5s %8s %8s %8s %8s' % (
+        'geometry', 'size', 'border', 'dot', 'label',
+        'time', 'memory', 'elements', 'bytes'), file=sys.stderr)
+    for result in results:
+        old = before.get(case_key(result))
+        if old is None:
+            continue
+        ratios = [result[k] / old[k] if old[k] else float('nan')
+                  for k in ['seconds', 'peak_bytes', 'elements',
+                            'output_bytes']]
+        print('%-12s %5d %-7s %-5s %-5s %8.2f %8.2f %8.2f %8.2f' % (
+            (result['geometry'], result['size_hx'], result['border_style'],
+             result['center_dot'], result['label']) + tuple(ratios)),
+              file=sys.stderr)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--geometry', nargs='+',
+                        default=sweep_defaults['geometry'],
+                        choices=sorted(hexmap_core.grid_geometries))
+    parser.add_argument('--size', nargs='+', type=int,
+                        default=sweep_defaults['size'],
+                        help='Number of columns and rows of each map')
+    parser.add_argument('--border-style', nargs='+',
+                        default=sweep_defaults['border_style'],
+                        choices=sweep_defaults['border_style'])
+    parser.add_argument('--center-dot', nargs='+', type=boolean,
+                        default=sweep_defaults['center_dot'])
+    parser.add_argument('--label', nargs='+', type=boolean,
+                        default=sweep_defaults['label'])
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='Time the best of this many runs')
+    parser.add_argument('--effect', action='store_true',
+                        help='Draw with HexmapEffect instead of the headless writer')
+    parser.add_argument('--output', default='-',
+                        help='File for the JSON report (default: stdout)')
+    parser.add_argument('--compare',
+                        help='Earlier JSON report to compare the results with')
+    args = parser.parse_args(argv)
+
+    sweep = {
+        'geometry': args.geometry,
+        'size': args.size,
+        'border_style': args.border_style,
+        'center_dot': args.center_dot,
+        'label': args.label
+    }
+
+    startup = measure_startup(startup_modules, args.repeat)
+    for (module, seconds) in startup.items():
+        sys.stderr.write('import %s: %.3fs\n' % (module, seconds))
+
+    if args.effect:
+        blank = tempfile.NamedTemporaryFile('w', suffix='.svg', delete=False)
+        with blank:
+            blank.write(blank_document)
+        draw = lambda params: write_effect(params, blank.name)
+    else:
+        draw = write_headless
+
+    results = []
+    try:
+        for params in cases(sweep):
+            result = dict(params)
+            result.update(measure(draw, params, args.repeat))
+            results.append(result)
+            sys.stderr.write('%(geometry)s %(size_hx)dx%(size_hy)d '
+                             '%(border_style)s dot=%(center_dot)s '
+                             'label=%(label)s: %(seconds).3fs, '
+                             '%(elements)d elements\n' % result)
+    finally:
+        if args.effect:
+            os.unlink(blank.name)
+
+    numpy = hexmap_core.load_numpy()
+    report = {
+        'writer': 'effect' if args.effect else 'headless',
+        'python': platform.python_version(),
+        'numpy': numpy.__version__ if numpy else None,
+        'repeat': args.repeat,
+        'startup': startup,
+        'results': results
+    }
+    if args.output == '-':
+        json.dump(report, sys.stdout, indent=1)
+        sys.stdout.write('\n')
+    else:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=1)
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, startup, json.load(f))
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,3290 @@
+#!/usr/bin/env python3
+"""
+The geometry and drawing of hexmaps, without Inkscape.
+
+The grids, layouts and renderers only need lxml, so they can be used
+and timed on their own. The Inkscape effect in hexmap.py is a thin
+wrapper around them.
+"""
+
+import json
+import os
+import sys
+import time
+import math
+from contextlib import contextmanager
+from functools import lru_cache, partial
+from array import array
+from collections import namedtuple
+from lxml import etree
+
+# The namespaces of the elements and attributes of an Inkscape document
+NSS = {
+    'svg': 'http://www.w3.org/2000/svg',
+    'inkscape': 'http://www.inkscape.org/namespaces/inkscape',
+    'sodipodi': 'http://sodipodi.sourceforge.net/DTD/sodipodi-0.dtd',
+    'xlink': 'http://www.w3.org/1999/xlink'
+}
+
+def addNS(tag, ns=None):
+    """
+    The qualified name of a tag in one of the namespaces
+    """
+    if ns in NSS:
+        return '{%s}%s' % (NSS[ns], tag)
+    return tag
+
+# NumPy is optional: it enables the batch geometry path for large grids.
+# It takes longer to import than drawing a small map, so it is only
+# imported when a large grid first needs it.
+numpy = None
+_numpy_loaded = False
+
+def load_numpy():
+    """
+    Import NumPy on first use. Returns the module, or None when it is
+    not installed.
+    """
+    global numpy, _numpy_loaded
+    if not _numpy_loaded:
+        _numpy_loaded = True
+        try:
+            import numpy as module
+        except ImportError:
+            module = None
+        numpy = module
+    return numpy
+
+
+class NumberFormat:
+    """
+    How numbers are written into the SVG output: rounded to a fixed number
+    of decimal places, without trailing zeros. Path coordinates can also
+    be written relative to the previous point.
+    """
+
+    def __init__(self, precision=6, relative=False):
+        self.configure(precision, relative)
+
+    def configure(self, precision=6, relative=False):
+        """
+        Set the number of decimal places and the path coordinate style
+        """
+        self.precision = precision
+        self.relative = relative
+        self._format = '%%.%df' % precision
+
+    def round(self, v):
+        """
+        Round a number to the output precision
+        """
+        return round(v, self.precision)
+
+    def number(self, v):
+        """
+        Convert a number to its shortest string at the output precision
+        """
+        s = self._format % v
+        if '.' in s:
+            s = s.rstrip('0').rstrip('.')
+        if s == '-0':
+            return '0'
+        return s
+
+    def point(self, p):
+        """
+        Convert a Point to an 'x,y' string
+        """
+        return self.number(p.x) + ',' + self.number(p.y)
+
+# The format for all of the numbers in the output document
+output_format = NumberFormat()
+
+
+class PathData:
+    """
+    Build the d attribute of a path. Coordinates are absolute, or relative
+    to the previous point when the output format asks for it.
+    Relative offsets are taken between rounded points so that rounding
+    errors don't accumulate along the path.
+    """
+
+    # Commands are joined into one string this many at a time, which
+    # takes much less memory than the separate strings
+    _chunk = 4096
+
+    def __init__(self, fmt=None):
+        self._fmt = output_format if fmt is None else fmt
+        self._commands = []
+        self._chunks = []
+        self._count = 0
+        self._last = None
+
+    def __len__(self):
+        return self._count
+
+    def __str__(self):
+        return ' '.join(self._chunks + self._commands)
+
+    def _append(self, command):
+        self._commands.append(command)
+        self._count += 1
+        if len(self._commands) >= self._chunk:
+            self._chunks.append(' '.join(self._commands))
+            self._commands = []
+
+    def _add(self, command, p):
+        fmt = self._fmt
+        x = fmt.round(p.x)
+        y = fmt.round(p.y)
+        if fmt.relative and self._last is not None:
+            (lx, ly) = self._last
+            self._append('%s %s,%s' % (command.lower(),
+                                       fmt.number(x - lx),
+                                       fmt.number(y - ly)))
+        else:
+            self._append('%s %s,%s' % (command, fmt.number(x),
+                                       fmt.number(y)))
+        self._last = (x, y)
+
+    def move(self, p):
+        """
+        Start a new subpath at a point
+        """
+        self._add('M', p)
+
+    def line(self, p):
+        """
+        Draw a line to a point
+        """
+        self._add('L', p)
+
+    def append(self, commands):
+        """
+        Add commands that end back at the current point
+        """
+        self._append(commands)
+
+
+class StyleRegistry:
+    """
+    The styles of the map elements. Inline by default, or collected into
+    one <style> block of CSS classes with each element naming its class.
+    A class is named for the role of the elements that use it: tile,
+    tic, border, dot or label.
+    """
+
+    def __init__(self, enabled=False, prefix='hexmap'):
+        self.configure(enabled, prefix)
+
+    def configure(self, enabled=False, prefix='hexmap'):
+        """
+        Turn the classes on or off and forget any collected styles
+        """
+        self.enabled = enabled
+        self._prefix = prefix
+        self._classes = {}
+        self._names = set()
+
+    def class_name(self, role, style):
+        """
+        The class for a style, registering it when it is first seen
+        """
+        key = (role, style)
+        name = self._classes.get(key)
+        if name is None:
+            name = '%s-%s' % (self._prefix, role)
+            n = 1
+            while name in self._names:
+                n += 1
+                name = '%s-%s-%d' % (self._prefix, role, n)
+            self._classes[key] = name
+            self._names.add(name)
+        return name
+
+    def style(self, element, role, style):
+        """
+        Give an element a style
+        """
+        if self.enabled:
+            element.set('class', self.class_name(role, style))
+        else:
+            element.set('style', style)
+
+    def attribute(self, element, role, name, value):
+        """
+        Give an element a presentation attribute
+        """
+        if self.enabled:
+            element.set('class', self.class_name(role, name + ':' + value))
+        else:
+            element.set(name, value)
+
+    def css(self):
+        """
+        The collected styles as CSS rules
+        """
+        return '\n'.join('.%s{%s}' % (name, style)
+                         for ((role, style), name) in self._classes.items())
+
+    def draw(self, style_id='hexmap-styles'):
+        """
+        A <style> element holding the collected styles
+        """
+        element = etree.Element('style')
+        element.set('id', style_id)
+        element.set('type', 'text/css')
+        element.text = self.css()
+        return element
+
+    def define(self, defs, style_id='hexmap-styles'):
+        """
+        Put the collected styles into the defs, replacing the ones from an
+        earlier run
+        """
+        for old in defs.iterchildren():
+            if old.get('id') == style_id:
+                defs.remove(old)
+        if self._classes:
+            defs.append(self.draw(style_id))
+
+# The styles for all of the elements in the output document
+output_styles = StyleRegistry()
+
+
+class PhaseTimer:
+    """
+    The wall time spent in each phase of a run, reported by --profile.
+    Iterating over the hexes is interleaved with drawing them, so that
+    phase counts only the time spent producing each hex.
+    """
+
+    def __init__(self, enabled=False):
+        self.configure(enabled)
+
+    def configure(self, enabled=False):
+        """
+        Turn the timer on or off and forget any collected times
+        """
+        self.enabled = enabled
+        self.seconds = {}
+        self.counts = {}
+        self.workers = []
+
+    def add(self, name, seconds, count=0):
+        """
+        Add to the time of a phase
+        """
+        self.seconds[name] = self.seconds.get(name, 0.0) + seconds
+        if count:
+            self.counts[name] = self.counts.get(name, 0) + count
+
+    def add_worker(self, timing):
+        """
+        Record the timing of a piece of work done by another process
+        """
+        if self.enabled:
+            self.workers.append(timing)
+
+    @contextmanager
+    def phase(self, name):
+        """
+        Time the body of a with statement as a phase
+        """
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def timed(self, name, iterable):
+        """
+        Iterate, timing only the steps of the iterable and not the work
+        done with each item
+        """
+        clock = time.perf_counter
+        it = iter(iterable)
+        (total, count) = (0.0, 0)
+        try:
+            while True:
+                start = clock()
+                try:
+                    item = next(it)
+                except StopIteration:
+                    total += clock() - start
+                    return
+                total += clock() - start
+                count += 1
+                yield item
+        finally:
+            self.add(name, total, count)
+
+    def report(self, **extra):
+        """
+        The collected times as a dict for JSON. The drawing phase
+        includes the hex iteration, which is split out as its own phase.
+        """
+        phases = dict(self.seconds)
+        if 'drawing' in phases:
+            phases['elements'] = phases.pop('drawing') - phases.get('hexes', 0.0)
+        report = {
+            'phases': phases,
+            'counts': dict(self.counts),
+            'total': sum(phases.values())
+        }
+        if self.workers:
+            report['workers'] = list(self.workers)
+        report.update(extra)
+        return report
+
+    def write(self, destination, **extra):
+        """
+        Write the report as JSON to a file, or to stderr for '-'
+        """
+        text = json.dumps(self.report(**extra), indent=1) + '\n'
+        if destination in ['', '-']:
+            sys.stderr.write(text)
+        else:
+            with open(destination, 'w') as f:
+                f.write(text)
+
+# The phase times of the current run
+phase_timer = PhaseTimer()
+
+
+class Point(namedtuple('Point', ['x', 'y'])):
+    """
+    This class implements some simple vector algebra for cartesian coodinates
+    Several methods assume an offset from the origin to represent
+    a region with the origin at one corner.
+
+    Points are immutable values built on a named tuple, so they can be
+    compared and hashed by their coordinates and used as cache keys.
+    """
+
+    __slots__ = ()
+
+    def __str__(self):
+        """
+        Convert a Point object to a string
+        """
+        return output_format.point(self)
+
+    def __sub__(self, other):
+        """
+        Cartesian vector subtraction
+        """
+        return Point(self.x - other.x, self.y - other.y)
+
+    def __add__(self, other):
+        """
+        Cartesian vector addition
+        """
+        return Point(self.x + other.x, self.y + other.y)
+
+    def __mul__(self, k):
+        """
+        Cartesian dot-product of a vector and scalar value
+        """
+        if isinstance(k, Point):
+            return Point(self.x * k.x, self.y * k.y)
+
+        if isinstance(k, int) or isinstance(k, float):
+            return Point(self.x * k, self.y * k)
+
+        raise ValueError("point muliplier must be point or scalar")
+
+    # A scalar multiplier on the left must not repeat the tuple
+    __rmul__ = __mul__
+
+    @property
+    def swap(self):
+        """
+        Swap the X and Y coordinates
+        """
+        return Point(self.y, self.x)
+
+# ----------------------------------------------------------------------------
+# Hex Map Geometry
+# ----------------------------------------------------------------------------
+
+class HexVector(namedtuple('HexVector', ['hx', 'hy'], defaults=(0, 0))):
+    """
+    This class represents a single point on a hexmap or triangular tesselation
+
+    HexVectors are immutable values built on a named tuple, so they can
+    be used as set members and dictionary keys.
+    """
+
+    __slots__ = ()
+
+    def __str__(self):
+        return "{},{}".format(self.hx, self.hy)
+
+    def __repr__(self):
+        return "HexVector({}, {})".format(self.hx, self.hy)
+
+    @property
+    def hz(self):
+        return self.hy - self.hx
+
+    @property
+    def swap(self):
+        return HexVector(self.hy, self.hx)
+
+    def __add__(self, other):
+        if isinstance(other, HexVector):
+            return HexVector(self.hx + other.hx, self.hy + other.hy)
+        raise ValueError("operand of HexVector addition must be a HexVector")
+
+    def __sub__(self, other):
+        if isinstance(other, HexVector):
+            return HexVector(self.hx - other.hx, self.hy - other.hy)
+        raise ValueError("operand of HexVector addition must be a HexVector")
+
+    def __mul__(self, other):
+        # Not a scalar multiple, and not the repeated tuple either
+        return NotImplemented
+
+    __rmul__ = __mul__
+
+HexVector.ORIGIN = HexVector(0, 0)
+HexVector.UNIT = [
+    HexVector(0, -1),
+    HexVector(1, 0),
+    HexVector(1, 1),
+    HexVector(0, 1),
+    HexVector(-1, 0),
+    HexVector(-1, -1)
+]
+
+def hex_id(kind, hexloc):
+    """
+    The element id for a part of the drawing of one hex, so that
+    redrawing a map gives every hex the same id
+    """
+    return '{}_{}_{}'.format(kind, hexloc.hx, hexloc.hy)
+
+
+class HexTile:
+    """
+    TBD
+    """
+
+    # Indicate the multipliers for hexrun and hexrise
+
+    _vertices = {}
+    _vertices['interior'] = [
+        Point(-2, 0),
+        Point(-1, -1),
+        Point(1, -1),
+        Point(2, 0),
+        Point(1, 1),
+        Point(-1, 1),
+        # Wrap back to close the polygon
+        Point(-2, 0)
+    ]
+    _vertices['top'] = _vertices['interior'][0:4]
+    _vertices['bottom'] = _vertices['interior'][3:7]
+    _vertices['left'] = [
+        Point(0, -1),
+        Point(1, -1),
+        Point(2, 0),
+        Point(1, 1),
+        Point(0, 1)        
+    ]
+    _vertices['right'] = [Point(-v.x, v.y) for v in _vertices['left']]
+
+    def __init__(self, center, size, side='interior'):
+        """
+        TBD
+        """
+        self._center = center
+        self._size = size
+        self._side = side
+
+    #@property
+    def vertices(self, orientation):
+        """
+        6 vertices offset from center
+        """
+        # translate the vertices to the canvas location
+        c = self._center
+        return [p + c for p in
+                self.vertex_offsets(self._side, orientation, self._size)]
+
+    def tics(self, orientation, tic_size=0.25):
+        """
+        The end points of the corner tics on the canvas
+        """
+        c = self._center
+        return [(start + c, end + c) for (start, end) in
+                self.tic_offsets(self._side, orientation, self._size,
+                                 tic_size)]
+
+    @classmethod
+    @lru_cache(maxsize=64)
+    def vertex_offsets(cls, side, orientation, size):
+        """
+        The vertices of a side of the tile relative to its center, scaled
+        and rotated. They are the same for every tile of a map, so they
+        are cached for each shape, side, orientation and size.
+        """
+        # Scale the hex vertices
+        points = tuple(p * size for p in cls._vertices[side])
+
+        # Rotate the vertices for horizontal
+        if orientation == 'horizontal':
+            points = tuple(p.swap for p in points)
+        return points
+
+    @classmethod
+    @lru_cache(maxsize=64)
+    def tic_offsets(cls, side, orientation, size, tic_size=0.25):
+        """
+        The corner tics of a side of the tile relative to its center
+        """
+        return tuple(cls.tic_segments(
+            cls.vertex_offsets(side, orientation, size), tic_size))
+
+    @property
+    def center(self):
+        """
+        The center of the tile on the canvas
+        """
+        return self._center
+
+    @property
+    def label_offset(self):
+        """
+        TBD
+        """
+        if self._side in ['interior', 'top', 'bottom']:
+            offset = Point(0, (self._size.y * 0.75))
+        elif self._side == 'left':
+            offset = Point(self._size.x, 0)
+        elif self._side == 'right':
+            offset = Point(-self._size.x, 0)
+
+        return offset
+
+    @property
+    def label_center(self):
+        """
+        TBD
+        """
+
+        c = self._center
+        p = c + self.label_offset
+        return p
+        
+    def draw(self, stroke, orientation, border='solid', tic_size=0.25, dot=True):
+        """
+        Draw the complete hex
+
+        Border (solid, corners)
+        Center
+        Label
+        """
+
+        group = etree.Element('g')
+
+        if border == 'solid':
+            group.append(self._polyline(self.vertices(orientation)))
+        elif border == 'vertex':
+            for t in self._tics(orientation, tic_size):
+                group.append(t)
+            
+        # or append corners
+        # Append dots
+        if (dot and self._side in ['interior', 'top', 'bottom']):
+            c = self._center
+            group.append(self._circle(stroke, c))
+
+        # An empty group is left unstyled, so it adds no style class
+        if len(group):
+            role = 'tic' if border == 'vertex' else 'tile'
+            output_styles.style(group, role, self.stroke_style(stroke))
+
+        return group
+
+    @staticmethod
+    def stroke_style(stroke):
+        """
+        The line style of borders and tics
+        """
+        return ('stroke:#cccccc; stroke-width:' + output_format.number(stroke)
+                + ';stroke-linecap:round')
+
+    def _circle(self, radius, loc=None):
+        """
+        Create an SVG Circle object with the indicated size
+        """
+        circle = etree.Element('circle')
+        circle.set('r', output_format.number(radius))
+        output_styles.attribute(circle, 'dot', 'fill', 'black')
+
+        if loc is not None:
+            circle.set('cx', output_format.number(loc.x))
+            circle.set('cy', output_format.number(loc.y))
+        return circle
+
+    def _polyline(self, vertices):
+        """
+        TBD
+        """
+        pline = etree.Element('polyline')
+        output_styles.attribute(pline, 'border', 'fill', 'none')
+        pline.set('points', ' '.join([str(p) for p in vertices]))
+        return pline
+
+    def _tics(self, orientation, tic_size=0.25):
+        """
+        Draw just corner tics for each vertex
+        """
+        return [self._line(t) for t in self.tics(orientation, tic_size)]
+
+    @staticmethod
+    def tic_segments(vertices, tic_size=0.25):
+        """
+        The end points of the corner tics for each vertex
+        """
+        # for each pair of points in the vertices list...
+        for i in range(0, len(vertices) - 1):
+
+            (start, end) = vertices[i:i+2]
+            tic = (end - start) * tic_size
+            # each pair of vertices, draw two tics, on from each vertex
+            # toward the other
+            yield (start, start + tic)
+            yield (end, end - tic)
+
+    def _line(self, endpoints):
+            line = etree.Element('line')
+            (start, end) = endpoints
+            line.set('x1', output_format.number(start.x))
+            line.set('y1', output_format.number(start.y))
+            line.set('x2', output_format.number(end.x))
+            line.set('y2', output_format.number(end.y))
+
+            return line
+
+
+class BrickTile(HexTile):
+    """
+    A rectangular tile that fills one column step of a hex grid, so that
+    the offset columns lay out like courses of bricks
+    """
+    _vertices = {}
+    _vertices['interior'] = [
+        Point(-1.5, -1),
+        Point(1.5, -1),
+        Point(1.5, 1),
+        Point(-1.5, 1),
+        # Wrap back to close the polygon
+        Point(-1.5, -1)
+    ]
+    _vertices['top'] = [
+        Point(-1.5, 0),
+        Point(-1.5, -1),
+        Point(1.5, -1),
+        Point(1.5, 0)
+    ]
+    _vertices['bottom'] = [Point(-v.x, -v.y) for v in _vertices['top']]
+    _vertices['left'] = [
+        Point(0, -1),
+        Point(1.5, -1),
+        Point(1.5, 1),
+        Point(0, 1)
+    ]
+    _vertices['right'] = [Point(-v.x, v.y) for v in _vertices['left']]
+
+
+class SquareTile(BrickTile):
+    """
+    TBD
+    """
+    _height_ratio = 1
+
+
+class HexLabel:
+    """
+    This class represents and draws a hex coordinate label
+    """
+
+    def __init__(self, hextile, edge='interior', text=None):
+        self._hextile = hextile
+        self._edge = edge
+        self._text = text
+
+    def draw(self, loc, font_size, anchor='middle'):
+        label = etree.Element('text')
+
+        label.text = str(self._hextile) if self._text is None else self._text
+
+        # Set the fond and drawing characteristics
+        output_styles.style(label, 'label', self.style(font_size, anchor))
+
+        label.set('x', output_format.number(loc.x))
+        label.set('y', output_format.number(loc.y))
+
+        return label
+
+    @staticmethod
+    def style(font_size, anchor='middle'):
+        """
+        The text style of a label
+        """
+        return ('text-align:center;text-anchor:%s;font-size:%spt'
+                % (anchor, output_format.number(font_size)))
+
+
+def nrdigits(n):
+    """
+    The number of decimal digits needed to write an integer
+    """
+    return len(str(abs(n)))
+
+def alpha(n):
+    """
+    Spreadsheet style column letters: 1 is A, 26 is Z and 27 is AA.
+    Numbers below 1 have no letters and are written as digits.
+    """
+    if n < 1:
+        return str(n)
+    letters = ''
+    while n > 0:
+        (n, r) = divmod(n - 1, 26)
+        letters = chr(ord('A') + r) + letters
+    return letters
+
+
+class HexLabelFormat:
+    """
+    The text of the hex labels for one map.
+
+    Every column and row string is formatted once when the map is
+    started, with the separator already attached to whichever comes
+    first, so each label is a single concatenation.
+    """
+
+    def __init__(self, label_spec, grid):
+        self._grid = grid
+        size = grid.size
+
+        columns = [self._column(label_spec, c) for c in range(size.hx)]
+        rows = [self._row(label_spec, r, size.hy) for r in range(size.hy)]
+
+        sep = label_spec['seperator']
+        if label_spec['invert']:
+            self._first_is_row = True
+            self._first = [r + sep for r in rows]
+            self._second = columns
+        else:
+            self._first_is_row = False
+            self._first = [c + sep for c in columns]
+            self._second = rows
+
+    @staticmethod
+    def _column(spec, col):
+        """
+        The column part of a label
+        """
+        n = col + spec['colstart']
+        if spec['alphacolumn']:
+            return alpha(n)
+        if spec['zeropad']:
+            return '%0*d' % (spec['hxdigits'], n)
+        return str(n)
+
+    @staticmethod
+    def _row(spec, row, rows):
+        """
+        The row part of a label
+        """
+        if spec['reverse_row']:
+            row = rows - 1 - row
+        n = row + spec['rowstart']
+        if spec['zeropad']:
+            return '%0*d' % (spec['hydigits'], n)
+        return str(n)
+
+    def label(self, hexloc):
+        """
+        The label text for a hex
+        """
+        (col, row) = self._grid.offset(hexloc)
+        if self._first_is_row:
+            return self._first[row] + self._second[col]
+        return self._first[col] + self._second[row]
+
+
+
+class HexLabels:
+    """
+    Draw the labels of a map in one of three ways:
+
+    text   one <text> element for each hex
+    column one <text> element for each column, with a positioned <tspan>
+           for each hex
+    single one <text> element for the whole map, with a positioned
+           <tspan> for each hex
+
+    The tspans share the style of their text element. The id of the
+    text elements for columns or the whole map start with the name.
+    """
+
+    def __init__(self, label_spec, grid, font_size, mode='text',
+                 name='hexlabels'):
+        self._names = HexLabelFormat(label_spec, grid)
+        self._grid = grid
+        self._name = name
+        self._font_size = font_size
+        self._mode = mode
+        self._text = None
+        self._column = None
+
+    def add(self, hexloc, edge, loc):
+        """
+        Add the label of a hex. Returns the list of label elements that
+        are complete.
+        """
+        name = self._names.label(hexloc)
+        if self._mode == 'text':
+            label = HexLabel(hexloc, edge, name).draw(loc, self._font_size)
+            label.set('id', hex_id('hexlabel', hexloc))
+            return [label]
+
+        done = []
+        if self._mode == 'column':
+            column = self._grid.offset(hexloc)[0]
+            if column != self._column:
+                done = self.finish()
+                self._column = column
+
+        if self._text is None:
+            self._text = etree.Element('text')
+            if self._mode == 'column':
+                self._text.set('id', '{}_{}'.format(self._name, column))
+            else:
+                self._text.set('id', self._name)
+            output_styles.style(self._text, 'label',
+                                HexLabel.style(self._font_size))
+
+        tspan = etree.SubElement(self._text, 'tspan')
+        tspan.set('x', output_format.number(loc.x))
+        tspan.set('y', output_format.number(loc.y))
+        tspan.text = name
+        return done
+
+    def finish(self):
+        """
+        Returns the label element still being filled, if any
+        """
+        if self._text is None:
+            return []
+        text = self._text
+        self._text = None
+        return [text]
+
+# ============================================================================
+# Shared borders
+#   Neighbouring tiles share their edges. These classes collect the edges
+#   of a whole grid so that each one is drawn exactly once.
+# ============================================================================
+def tile_segments(lattice, side='interior', tile=HexTile):
+    """
+    The border segments of the tile centered at a lattice point, each as
+    (key, (start, end)).
+
+    Tile centers and vertex offsets are both whole numbers of hexrun and
+    hexrise, so every segment is keyed by its two end points on that
+    integer lattice. The key is the same whichever tile contributes the
+    segment, including the half edges of partial tiles on the map edges.
+    """
+    (lx, ly) = lattice
+    points = [(lx + v.x, ly + v.y) for v in tile._vertices[side]]
+    for (start, end) in zip(points, points[1:]):
+        key = (start, end) if start <= end else (end, start)
+        yield (key, (start, end))
+
+def trace_segment(data, layout, segment, last=None):
+    """
+    Add a lattice segment to a path, continuing the subpath that ended
+    at last if the segment starts there. Returns the end of the segment.
+    """
+    (start, end) = segment
+    if start != last:
+        data.move(layout.lattice_point(start))
+    data.line(layout.lattice_point(end))
+    return end
+
+def stroked_path(data, role, style, fill_role='border'):
+    """
+    A single unfilled path in a group that carries its stroke, so that
+    with style classes the path keeps its own class for the fill
+    """
+    group = etree.Element('g')
+    output_styles.style(group, role, style)
+
+    path = etree.SubElement(group, 'path')
+    output_styles.attribute(path, fill_role, 'fill', 'none')
+    path.set('d', str(data))
+
+    return group
+
+class HexEdgeSet:
+    """
+    The border segments of a set of tiles, with each shared segment stored
+    only once under its key from tile_segments().
+    """
+
+    def __init__(self, tile=HexTile):
+        self._tile = tile
+        self._edges = {}
+
+    def __len__(self):
+        return len(self._edges)
+
+    def __iter__(self):
+        """
+        The segments in the order they were first added
+        """
+        return iter(self._edges.values())
+
+    def add(self, lattice, side='interior'):
+        """
+        Add the border segments of the tile centered at a lattice point
+        """
+        for (key, segment) in tile_segments(lattice, side, self._tile):
+            if key not in self._edges:
+                self._edges[key] = segment
+
+    def path_data(self, layout, data=None):
+        """
+        Add the segments to a path, joining consecutive segments that meet
+        end to end
+        """
+        data = PathData() if data is None else data
+        last = None
+        for segment in self:
+            last = trace_segment(data, layout, segment, last)
+        return data
+
+
+class HexEdgeStream:
+    """
+    The border segments of tiles added a column at a time, with each
+    shared segment written to a path once, as soon as it is first seen.
+
+    Segments are keyed on the lattice like those of a HexEdgeSet. A
+    segment is only shared by tiles in the same or the next column, so
+    the keys are forgotten two columns later and memory grows with the
+    path data rather than with a set of every segment.
+    """
+
+    def __init__(self, layout, tile=HexTile):
+        self._layout = layout
+        self._tile = tile
+        self._column = None
+        self._current = set()
+        self._previous = set()
+        self._last = None
+        self.data = PathData()
+
+    def add(self, lattice, side='interior'):
+        """
+        Add the border segments of the tile centered at a lattice point,
+        joining consecutive segments that meet end to end
+        """
+        if lattice[0] != self._column:
+            (self._column, self._previous, self._current) = (
+                lattice[0], self._current, set())
+        for (key, segment) in tile_segments(lattice, side, self._tile):
+            if key in self._current or key in self._previous:
+                continue
+            self._current.add(key)
+            self._last = trace_segment(self.data, self._layout, segment,
+                                       self._last)
+
+    def draw(self, stroke):
+        """
+        Draw all of the segments as a single path
+        """
+        return stroked_path(self.data, 'tile', HexTile.stroke_style(stroke))
+
+
+class HexVertexSet:
+    """
+    The corner tics of tiles added a column at a time, with each shared
+    corner drawn once.
+
+    Vertices are keyed on the hexrun/hexrise lattice like the segments of
+    a HexEdgeSet, so a corner shared by three tiles is found whichever
+    tile adds it. Each vertex keeps the far ends of the borders that
+    leave it, and a tic runs tic_size of the way along each one. A tile
+    reaches two runs either side of its center, so a corner is complete
+    once the columns have moved past it, and it is drawn then.
+    """
+
+    def __init__(self, layout, tic_size=0.25, tile=HexTile):
+        self._layout = layout
+        self._tic_size = tic_size
+        self._tile = tile
+        self._vertices = {}
+        self._column = None
+        self._data = PathData()
+
+    def __len__(self):
+        return len(self._vertices)
+
+    def add(self, lattice, side='interior'):
+        """
+        Add the corners of the tile centered at a lattice point
+        """
+        if lattice[0] != self._column:
+            self._column = lattice[0]
+            self._flush(self._column - 2)
+        for (key, (start, end)) in tile_segments(lattice, side, self._tile):
+            self._join(start, end)
+            self._join(end, start)
+
+    def _join(self, vertex, other):
+        ends = self._vertices.setdefault(vertex, [])
+        if other not in ends:
+            ends.append(other)
+
+    def _flush(self, limit):
+        """
+        Draw the corners left of the limit, which no tile still to come
+        can reach
+        """
+        done = [v for v in self._vertices if v[0] < limit]
+        for vertex in done:
+            self._corner(vertex, self._vertices.pop(vertex))
+
+    def _corner(self, vertex, ends):
+        """
+        Add the tics of a corner to the path. Two tics are one subpath
+        through the corner, and any others start from it.
+        """
+        layout = self._layout
+        tic_size = self._tic_size
+        (vx, vy) = vertex
+        corner = layout.lattice_point(vertex)
+        tips = [layout.lattice_point((vx + (ex - vx) * tic_size,
+                                      vy + (ey - vy) * tic_size))
+                for (ex, ey) in ends]
+        data = self._data
+        data.move(tips[0])
+        data.line(corner)
+        if len(tips) > 1:
+            data.line(tips[1])
+        for tip in tips[2:]:
+            data.move(corner)
+            data.line(tip)
+
+    @property
+    def data(self):
+        """
+        The path of all of the tics added
+        """
+        self._flush(math.inf)
+        return self._data
+
+    def draw(self, stroke):
+        """
+        Draw all of the tics as a single path
+        """
+        return stroked_path(self.data, 'tile', HexTile.stroke_style(stroke),
+                            'tic')
+
+
+class HexPaths:
+    """
+    The borders and center dots of a whole grid, collected into one path
+    for the borders and one compound path for the dots
+    """
+
+    def __init__(self, layout, border='solid', tic_size=0.25, dot=True):
+        self._layout = layout
+        self._border = border
+        self._tic_size = tic_size
+        self._dot = dot
+        # Solid borders are drawn once per edge
+        self._edges = None
+        if border in ['solid', 'shared']:
+            self._edges = HexEdgeStream(layout)
+        # and shared tics once per corner
+        self._vertices = None
+        if border == 'shared-vertex':
+            self._vertices = HexVertexSet(layout, tic_size)
+        self._tics = PathData()
+        # The dots are drawn as they are added, sized to the layout stroke
+        self._dots = PathData()
+        self._dot_arcs = self._arcs(layout.stroke_width)
+
+    def add(self, hexloc, tile, side='interior'):
+        """
+        Add the border and dot of one tile
+        """
+        if self._edges is not None:
+            self._edges.add(self._layout.tile_lattice(hexloc), side)
+        elif self._vertices is not None:
+            self._vertices.add(self._layout.tile_lattice(hexloc), side)
+        elif self._border == 'vertex':
+            for (start, end) in tile.tics(self._layout.orientation,
+                                          self._tic_size):
+                self._tics.move(start)
+                self._tics.line(end)
+
+        if self._dot and side in ['interior', 'top', 'bottom']:
+            center = tile.center
+            self._dots.move(Point(center.x - self._layout.stroke_width,
+                                  center.y))
+            self._dots.append(self._dot_arcs)
+
+    def draw(self, stroke):
+        """
+        Draw the collected borders and dots
+        """
+        group = etree.Element('g')
+        output_styles.style(group, 'tile', HexTile.stroke_style(stroke))
+
+        if self._edges is not None:
+            (role, border) = ('border', self._edges.data)
+        elif self._vertices is not None:
+            (role, border) = ('tic', self._vertices.data)
+        else:
+            (role, border) = ('tic', self._tics)
+        if border:
+            path = etree.Element('path')
+            output_styles.attribute(path, role, 'fill', 'none')
+            path.set('d', str(border))
+            group.append(path)
+
+        if self._dots:
+            dots = etree.Element('path')
+            output_styles.attribute(dots, 'dot', 'fill', 'black')
+            dots.set('d', str(self._dots))
+            group.append(dots)
+
+        return group
+
+    @staticmethod
+    def _arcs(radius):
+        """
+        Each dot is a circle drawn as a closed pair of arcs
+        """
+        r = output_format.number(radius)
+        d = output_format.number(2 * radius)
+        return 'a %s,%s 0 1,0 %s,0 a %s,%s 0 1,0 -%s,0 z' % (r, r, d, r, r, d)
+
+class HexSymbols:
+    """
+    Tiles drawn once as symbols in the document <defs> and placed on the
+    map with <use> elements. There is one symbol for each distinct
+    combination of side, orientation, border style and tic size.
+    """
+
+    def __init__(self, defs, size, stroke, orientation, border='solid',
+                 tic_size=0.25, dot=True):
+        self._defs = defs
+        self._size = size
+        self._stroke = stroke
+        self._orientation = orientation
+        self._border = border
+        self._tic_size = tic_size
+        self._dot = dot
+        self._symbols = {}
+
+    def symbol_id(self, side):
+        """
+        The id of the symbol for a tile side, or None if the tile draws
+        nothing
+        """
+        key = (side, self._orientation, self._border, self._tic_size)
+        if key not in self._symbols:
+            self._symbols[key] = self._define(*key)
+        return self._symbols[key]
+
+    def _define(self, side, orientation, border, tic_size):
+        """
+        Draw a tile centered on the origin into a new symbol. A tile
+        without a border or dot gets no symbol.
+        """
+        symbol_id = 'hextile-%s-%s-%s-%d' % (side, orientation, border,
+                                              round(tic_size * 200))
+
+        # Replace the symbol left by an earlier run or region
+        for old in list(self._defs.iterchildren()):
+            if old.get('id') == symbol_id:
+                self._defs.remove(old)
+
+        tile = HexTile(Point(0, 0), self._size, side)
+        group = tile.draw(self._stroke, orientation, border, tic_size,
+                          self._dot)
+        if not len(group):
+            return None
+
+        symbol = etree.Element('symbol')
+        symbol.set('id', symbol_id)
+        # The tile extends to either side of the use location
+        symbol.set('style', 'overflow:visible')
+        symbol.append(group)
+        self._defs.append(symbol)
+
+        return symbol_id
+
+    def place(self, center, side='interior'):
+        """
+        Place a tile of the given side at a point on the canvas. Returns
+        None when the tile draws nothing.
+        """
+        symbol_id = self.symbol_id(side)
+        if symbol_id is None:
+            return None
+        use = etree.Element('use')
+        use.set(addNS('href', 'xlink'), '#' + symbol_id)
+        use.set('x', output_format.number(center.x))
+        use.set('y', output_format.number(center.y))
+        return use
+
+class HexPattern:
+    """
+    A rectangle grid drawn as one repeating SVG pattern.
+
+    Every other column of a rectangle grid is shifted half a hex, so the
+    pattern repeats every two columns and every row. The cell holds the
+    tiles that touch it, with the origin tile centered on its corner.
+    """
+
+    _centers = [
+        Point(0, 0), Point(2, 0), Point(0, 1), Point(2, 1),
+        Point(1, -0.5), Point(1, 0.5)
+    ]
+
+    def __init__(self, layout, border='solid', tic_size=0.25, dot=True):
+        self._layout = layout
+        self._border = border
+        self._tic_size = tic_size
+        self._dot = dot
+
+    def define(self, defs, pattern_id='hexmap-pattern'):
+        """
+        Draw the repeat cell into a pattern in the document defs
+        """
+        layout = self._layout
+
+        # Replace the pattern left by an earlier run
+        for old in defs.iterchildren():
+            if old.get('id') == pattern_id:
+                defs.remove(old)
+
+        cell = layout.tile_step * Point(2, 1)
+        corner = layout.origin
+        if layout.horizontal:
+            cell = cell.swap
+            corner = corner.swap
+
+        pattern = etree.SubElement(defs, 'pattern')
+        pattern.set('id', pattern_id)
+        pattern.set('patternUnits', 'userSpaceOnUse')
+        pattern.set('x', output_format.number(corner.x))
+        pattern.set('y', output_format.number(corner.y))
+        pattern.set('width', output_format.number(cell.x))
+        pattern.set('height', output_format.number(cell.y))
+
+        for step in self._centers:
+            center = step * layout.tile_step
+            if layout.horizontal:
+                center = center.swap
+            tile = HexTile(center, layout.tile_size)
+            pattern.append(tile.draw(layout.stroke_width, layout.orientation,
+                                     self._border, self._tic_size, self._dot))
+
+        return pattern_id
+
+    def draw(self, pattern_id='hexmap-pattern'):
+        """
+        The outline of the map filled with the pattern. The outline is
+        stroked with the pattern too, so that the outer half of the
+        borders on the edge of the map is painted.
+        """
+        path = etree.Element('path')
+        path.set('d', str(self.outline()))
+        path.set('style', 'fill:url(#{0});stroke:url(#{0});stroke-width:{1};'
+                 'stroke-linejoin:round'.format(
+                     pattern_id,
+                     output_format.number(self._layout.stroke_width)))
+        return path
+
+    def outline(self):
+        """
+        The path around the tiles of the map. A segment of a single tile
+        is on the outline, and every outline vertex joins two of them, so
+        each loop is followed from segment to segment.
+
+        Only the tiles on the edge of the map have outline segments, and
+        their neighbours are at most a column and a row further in, so
+        the segments are counted over the two outer rings of tiles. The
+        cost grows with the perimeter of the map, not its area.
+        """
+        layout = self._layout
+        grid = layout.grid
+        (first_col, end_col, first_row, end_row) = (
+            layout.region or (0, grid.size.hx, 0, grid.size.hy))
+
+        def ring(first, end):
+            return {n for n in (first, first + 1, end - 2, end - 1)
+                    if first <= n < end}
+        cols = ring(first_col, end_col)
+        rows = ring(first_row, end_row)
+        band = sorted({(c, r) for c in cols for r in range(first_row, end_row)}
+                      | {(c, r) for c in range(first_col, end_col)
+                         for r in rows})
+
+        counts = {}
+        edge = set()
+        for (col, row) in band:
+            lattice = layout.tile_lattice(grid.hex_at_offset(col, row))
+            outer = col in (first_col, end_col - 1) or row in (first_row,
+                                                               end_row - 1)
+            for (key, segment) in tile_segments(lattice):
+                counts[key] = counts.get(key, 0) + 1
+                if outer:
+                    edge.add(key)
+
+        neighbours = {}
+        for ((start, end), count) in counts.items():
+            if count == 1 and (start, end) in edge:
+                neighbours.setdefault(start, []).append(end)
+                neighbours.setdefault(end, []).append(start)
+
+        data = PathData()
+        while neighbours:
+            start = next(iter(neighbours))
+            (previous, vertex, last) = (None, start, None)
+            while True:
+                ends = neighbours.pop(vertex)
+                following = ends[1] if ends[0] == previous else ends[0]
+                last = trace_segment(data, layout, (vertex, following), last)
+                if following == start:
+                    break
+                (previous, vertex) = (vertex, following)
+            data.append('Z')
+        return data
+
+# ============================================================================
+# Grid classes
+#   These generate a list of hexes in a specified shape
+# ============================================================================
+# ============================================================================
+# Combined grid and placement classes
+# ============================================================================
+class HexGridRectangle:
+    """
+    This class represents the descrete locations on a hexmap
+    """
+
+    def __init__(self, size, origin=HexVector.ORIGIN, shift=False):
+        """
+        TBD
+        """
+        self._size = size
+        self._origin = origin
+        self._shift = shift
+
+    @property
+    def size(self):
+        return self._size
+
+    @property
+    def origin(self):
+        return self._origin
+
+    def __len__(self):
+        """
+        The number of hexes in the map
+        """
+        return self._size.hx * self._size.hy
+
+    def __contains__(self, hexloc):
+        """
+        Is the hex on the map?
+        """
+        (col, row) = self.offset(hexloc)
+        return 0 <= col < self._size.hx and 0 <= row < self._size.hy
+
+    def __iter__(self):
+        return self.hexes
+
+    def index(self, hexloc):
+        """
+        The position of a hex in the order of hexes
+        """
+        if hexloc not in self:
+            raise ValueError("{} is not on the map".format(hexloc))
+        (col, row) = self.offset(hexloc)
+        return col * self._size.hy + row
+
+    def hex_at(self, i):
+        """
+        The hex at a position in the order of hexes
+        """
+        if not 0 <= i < len(self):
+            raise IndexError("hex index out of range")
+        return self.hex_at_offset(*divmod(i, self._size.hy))
+
+    def coords(self):
+        """
+        Iterate over the (hx, hy) coordinates of the hexes in the map
+        without creating a HexVector for each one
+        """
+        for col in range(0, self._size.hx):
+            top = self.hex_at_offset(col, 0)
+            (hx, hy) = (top.hx, top.hy)
+            (dx, dy) = self._column_step
+            for row in range(0, self._size.hy):
+                yield (hx + row * dx, hy + row * dy)
+
+    # Moving down a column changes the hex coordinates by this much
+    _column_step = (0, 1)
+
+    @property
+    def hexes(self):
+        """
+        A generator that iterates over all of the hexes in the map
+        """
+        (ox, oy) = (self._origin.hx, self._origin.hy)
+        for col in range(0, self._size.hx):
+            for row in range(0, self._size.hy):
+                yield HexVector(col + ox, row + oy)
+
+    def translate(self, hexloc):
+        """
+        Convert the hex location to units of hexrun and hexrise
+        """
+        # triangle
+        #return Point(hexloc.hx, hexloc.hy - (hexloc.hx / 2))
+        return Point(hexloc.hx, hexloc.hy - ((hexloc.hx % 2)/2))
+
+    def hex_array(self, first=0, count=None):
+        """
+        The coordinates of the hexes in a run of columns of the map as two
+        NumPy arrays, in the same order as hexes. By default all columns.
+        """
+        count = self._size.hx - first if count is None else count
+        cols = numpy.repeat(numpy.arange(first, first + count), self._size.hy)
+        rows = numpy.tile(numpy.arange(self._size.hy), count)
+        return (cols + self._origin.hx, rows + self._origin.hy)
+
+    def translate_array(self, hx, hy):
+        """
+        Convert arrays of hex locations to units of hexrun and hexrise
+        """
+        return (hx.astype(float), hy - ((hx % 2)/2))
+
+    def offset(self, hexloc):
+        """
+        The column and row of a hex counted from the first hex of the map
+        """
+        return (hexloc.hx - self._origin.hx, hexloc.hy - self._origin.hy)
+
+    def hex_at_offset(self, col, row):
+        """
+        The hex at a column and row counted from the first hex of the map
+        """
+        return HexVector(col + self._origin.hx, row + self._origin.hy)
+
+    def column_length(self, col):
+        """
+        The number of hexes in a column
+        """
+        return self._size.hy
+
+    # Offset rectangles can wrap their columns and rows
+    wraps = True
+
+    def axial(self, hexloc):
+        """
+        The axial (q, r) coordinates of a hex relative to the origin.
+        Each column is half a hex lower than the one to its left.
+        """
+        col = hexloc.hx - self._origin.hx
+        return (col, hexloc.hy - self._origin.hy + col // 2)
+
+    def from_axial(self, q, r):
+        """
+        The hex at axial coordinates relative to the origin
+        """
+        return HexVector(q + self._origin.hx, r - q // 2 + self._origin.hy)
+
+    def ybias(self, col):
+        """
+        Adjust the set of rows to create a rectangular grid for drawing
+        """
+        # Adjust so negative columns are properly shifted
+        c = col if col >= 0 else col - 1
+        return int(c / 2)
+
+    def ybias_array(self, col):
+        """
+        Compute ybias for an array of columns
+        """
+        c = numpy.where(col >= 0, col, col - 1)
+        return numpy.trunc(c / 2).astype(int)
+    
+    def edge(self, hexloc):
+        """
+        Determine if the hex is on an edge and if so, which one?
+        """
+
+        if self._shift is False:
+            return 'interior'
+
+        (col, row) = self.offset(hexloc)
+        if col == 0:
+            return 'left'
+        elif self._size.hx - col == 1:
+            return 'right'
+
+        if row == 0:
+            return 'top'
+        elif self._size.hy - row == 1:
+            return 'bottom'
+
+        return 'interior'
+
+class HexGridTriangle(HexGridRectangle):
+    """
+    TBD
+    """
+
+    @property
+    def hexes(self):
+        """
+        A generator that iterates over all of the hexes in the map
+        """
+        (ox, oy) = (self._origin.hx, self._origin.hy)
+        for col in range(0, self._size.hx):
+            ybias = self.ybias(col)
+            for row in range(ybias, self._size.hy + ybias):
+                yield HexVector(col + ox, row + oy)
+
+    def translate(self, hexloc):
+        """
+        Convert the hex location to units of hexrun and hexrise
+        """
+        # triangle
+        return Point(hexloc.hx, hexloc.hy - (hexloc.hx /2))
+
+    def offset(self, hexloc):
+        """
+        The column and row of a hex counted from the first hex of the map
+        """
+        col = hexloc.hx - self._origin.hx
+        return (col, hexloc.hy - self._origin.hy - self.ybias(col))
+
+    def hex_at_offset(self, col, row):
+        """
+        The hex at a column and row counted from the first hex of the map
+        """
+        return HexVector(col + self._origin.hx,
+                         row + self.ybias(col) + self._origin.hy)
+
+    def axial(self, hexloc):
+        """
+        Triangle coordinates are axial
+        """
+        return (hexloc.hx - self._origin.hx, hexloc.hy - self._origin.hy)
+
+    def from_axial(self, q, r):
+        return HexVector(q + self._origin.hx, r + self._origin.hy)
+
+    def hex_array(self, first=0, count=None):
+        """
+        The coordinates of the hexes in a run of columns of the map as two
+        NumPy arrays, in the same order as hexes. By default all columns.
+        """
+        count = self._size.hx - first if count is None else count
+        cols = numpy.repeat(numpy.arange(first, first + count), self._size.hy)
+        rows = (numpy.tile(numpy.arange(self._size.hy), count)
+                + self.ybias_array(cols))
+        return (cols + self._origin.hx, rows + self._origin.hy)
+
+    def translate_array(self, hx, hy):
+        """
+        Convert arrays of hex locations to units of hexrun and hexrise
+        """
+        return (hx.astype(float), hy - (hx / 2))
+    
+
+class HexGridHerringbone(HexGridRectangle):
+    @property
+    def hexes(self):
+        """
+        A generator that iterates over all of the hexes in the map
+        """
+        col_start = self._origin.hx - int(self._size.hx / 2)
+        col_end = col_start + self._size.hx
+        for col in range(col_start, col_end):
+            
+            ybias = self.ybias(col)
+            for row in range(ybias, self._size.hy + ybias):
+                yield HexVector(col+row, row)
+
+    def translate(self, hexloc):
+        """
+        Convert the hex location to units of hexrun and hexrise
+        """
+        # herringbone
+        return Point(hexloc.hx - hexloc.hy, hexloc.hy + hexloc.hz/2)
+
+    def offset(self, hexloc):
+        """
+        The column and row of a hex counted from the first hex of the map
+        """
+        col = hexloc.hx - hexloc.hy
+        col_start = self._origin.hx - int(self._size.hx / 2)
+        return (col - col_start, hexloc.hy - self.ybias(col))
+
+    def hex_at_offset(self, col, row):
+        """
+        The hex at a column and row counted from the first hex of the map
+        """
+        col += self._origin.hx - int(self._size.hx / 2)
+        row += self.ybias(col)
+        return HexVector(col + row, row)
+
+    def axial(self, hexloc):
+        """
+        Herringbone columns run along hx - hy
+        """
+        return (hexloc.hx - hexloc.hy, hexloc.hy)
+
+    def from_axial(self, q, r):
+        return HexVector(q + r, r)
+
+    # Moving down a column changes the hex coordinates by this much
+    _column_step = (1, 1)
+
+    def hex_array(self, first=0, count=None):
+        """
+        The coordinates of the hexes in a run of columns of the map as two
+        NumPy arrays, in the same order as hexes. By default all columns.
+        """
+        count = self._size.hx - first if count is None else count
+        col_start = self._origin.hx - int(self._size.hx / 2) + first
+        cols = numpy.repeat(numpy.arange(col_start, col_start + count),
+                            self._size.hy)
+        rows = (numpy.tile(numpy.arange(self._size.hy), count)
+                + self.ybias_array(cols))
+        return (cols + rows, rows)
+
+    def translate_array(self, hx, hy):
+        """
+        Convert arrays of hex locations to units of hexrun and hexrise
+        """
+        return ((hx - hy).astype(float), hy + (hy - hx)/2)
+
+
+class RectangularHexGrid(HexGridRectangle):
+    """
+    A rectangle of hexes where the odd columns sit half a hex lower than
+    the even ones, so the first column is the higher one. A plain
+    rectangle has the first column lower.
+
+    The hexes keep the axial coordinates of their neighbours, so the odd
+    columns run from hy 1 and the element ids of their hexes differ from
+    those of a plain rectangle. The labels are counted from the top of
+    each column and are the same.
+    """
+
+    def _ybias(self, hx):
+        """
+        Odd columns start one row down
+        """
+        return hx % 2
+
+    @property
+    def hexes(self):
+        """
+        A generator that iterates over all of the hexes in the map
+        """
+        (ox, oy) = (self._origin.hx, self._origin.hy)
+        for hx in range(0, self._size.hx):
+            min = self._ybias(hx)
+            for hy in range(min, min + self._size.hy):
+                yield HexVector(hx + ox, hy + oy)
+
+    def translate(self, hexloc):
+        """
+        Convert the hex location to units of hexrun and hexrise
+        """
+        # The first row of the even columns is the top of the map
+        return Point(hexloc.hx, hexloc.hy - ((hexloc.hx % 2)/2) - 0.5)
+
+    def translate_array(self, hx, hy):
+        """
+        Convert arrays of hex locations to units of hexrun and hexrise
+        """
+        return (hx.astype(float), hy - ((hx % 2)/2) - 0.5)
+
+    def hex_array(self, first=0, count=None):
+        """
+        The coordinates of the hexes in a run of columns of the map as two
+        NumPy arrays, in the same order as hexes. By default all columns.
+        """
+        count = self._size.hx - first if count is None else count
+        cols = numpy.repeat(numpy.arange(first, first + count), self._size.hy)
+        rows = numpy.tile(numpy.arange(self._size.hy), count) + cols % 2
+        return (cols + self._origin.hx, rows + self._origin.hy)
+
+    def offset(self, hexloc):
+        """
+        The column and row of a hex counted from the first hex of the map
+        """
+        col = hexloc.hx - self._origin.hx
+        return (col, hexloc.hy - self._origin.hy - self._ybias(col))
+
+    def hex_at_offset(self, col, row):
+        """
+        The hex at a column and row counted from the first hex of the map
+        """
+        return HexVector(col + self._origin.hx,
+                         row + self._ybias(col) + self._origin.hy)
+
+
+class RadialHexGrid(HexGridRectangle):
+    """
+    A hexagon of hexes around the origin hex.
+
+    The radius is the longer coordinate of the size. The map is drawn
+    in the box of 2 * radius + 1 columns and rows that holds it, and the
+    columns get shorter away from the center one.
+    """
+
+    def __init__(self, size, origin=HexVector.ORIGIN, shift=False):
+        """
+        Radial maps have no partial tiles on the edges
+        """
+        self._radius = max(abs(size.hx), abs(size.hy))
+        diameter = 2 * self._radius + 1
+        HexGridRectangle.__init__(self, HexVector(diameter, diameter),
+                                  origin, False)
+
+    @property
+    def radius(self):
+        return self._radius
+
+    def _column_rows(self, hx):
+        """
+        The first hy and the number of hexes in a column, relative to
+        the origin
+        """
+        radius = self._radius
+        first = -radius if hx < 0 else -radius + hx
+        return (first, 2 * radius + 1 - abs(hx))
+
+    def _before(self, col):
+        """
+        The number of hexes in the columns before a column
+        """
+        radius = self._radius
+        if col <= radius + 1:
+            return col * (radius + 1) + col * (col - 1) // 2
+        rest = 2 * radius + 1 - col
+        return len(self) - (rest * (radius + 1) + rest * (rest - 1) // 2)
+
+    def __len__(self):
+        radius = self._radius
+        return 3 * radius * (radius + 1) + 1
+
+    def __contains__(self, hexloc):
+        dx = hexloc.hx - self._origin.hx
+        dy = hexloc.hy - self._origin.hy
+        return max(abs(dx), abs(dy), abs(dy - dx)) <= self._radius
+
+    def index(self, hexloc):
+        if hexloc not in self:
+            raise ValueError("{} is not on the map".format(hexloc))
+        (col, row) = self.offset(hexloc)
+        return self._before(col) + row
+
+    def hex_at(self, i):
+        if not 0 <= i < len(self):
+            raise IndexError("hex index out of range")
+        # Find the last column that starts at or before i
+        (low, high) = (0, 2 * self._radius)
+        while low < high:
+            mid = (low + high + 1) // 2
+            if self._before(mid) <= i:
+                low = mid
+            else:
+                high = mid - 1
+        return self.hex_at_offset(low, i - self._before(low))
+
+    def column_length(self, col):
+        return self._column_rows(col - self._radius)[1]
+
+    def coords(self):
+        (ox, oy) = (self._origin.hx, self._origin.hy)
+        for hx in range(-self._radius, self._radius + 1):
+            (first, count) = self._column_rows(hx)
+            for hy in range(first, first + count):
+                yield (hx + ox, hy + oy)
+
+    def column(self, hx):
+        """
+        Produce a list of the hexes in the indicated column
+        """
+        (first, count) = self._column_rows(hx)
+        for hy in range(first, first + count):
+            yield HexVector(hx + self._origin.hx, hy + self._origin.hy)
+
+    @property
+    def hexes(self):
+        """
+        Produce a list of hexes in a radial map, column by column
+        """
+        for hx in range(-self._radius, self._radius + 1):
+            for hexloc in self.column(hx):
+                yield hexloc
+
+    def translate(self, hexloc):
+        """
+        Convert the hex location to units of hexrun and hexrise, with the
+        top left corner of the bounding box at the origin tile
+        """
+        radius = self._radius
+        return Point(hexloc.hx + radius, hexloc.hy - (hexloc.hx / 2) + radius)
+
+    def translate_array(self, hx, hy):
+        radius = self._radius
+        return (hx + float(radius), hy - (hx / 2) + radius)
+
+    def hex_array(self, first=0, count=None):
+        count = self._size.hx - first if count is None else count
+        cols = []
+        rows = []
+        for col in range(first, first + count):
+            hx = col - self._radius
+            (top, n) = self._column_rows(hx)
+            cols.append(numpy.full(n, hx))
+            rows.append(numpy.arange(top, top + n))
+        return (numpy.concatenate(cols) + self._origin.hx,
+                numpy.concatenate(rows) + self._origin.hy)
+
+    def offset(self, hexloc):
+        """
+        The column and row of a hex counted from the top of the first
+        column
+        """
+        hx = hexloc.hx - self._origin.hx
+        (first, count) = self._column_rows(hx)
+        return (hx + self._radius, hexloc.hy - self._origin.hy - first)
+
+    def hex_at_offset(self, col, row):
+        hx = col - self._radius
+        (first, count) = self._column_rows(hx)
+        return HexVector(hx + self._origin.hx, first + row + self._origin.hy)
+
+    # A hexagon has no opposite edges to join
+    wraps = False
+
+    def axial(self, hexloc):
+        """
+        Radial coordinates are axial
+        """
+        return (hexloc.hx - self._origin.hx, hexloc.hy - self._origin.hy)
+
+    def from_axial(self, q, r):
+        return HexVector(q + self._origin.hx, r + self._origin.hy)
+
+    def edge(self, hexloc):
+        return 'interior'
+
+
+grid_geometries = {
+    'rectangle': HexGridRectangle,
+    'triangle': HexGridTriangle,
+    'herringbone': HexGridHerringbone,
+    'radial': RadialHexGrid,
+    # A rectangle with the first column half a hex down
+    'sawtooth': RectangularHexGrid
+}
+
+def make_grid(geometry, size, origin, wrap_x=False, sawtooth=False):
+    """
+    Create the grid for a geometry. A sawtooth rectangle has its own grid.
+    """
+    if geometry == 'rectangle' and sawtooth:
+        geometry = 'sawtooth'
+    return grid_geometries[geometry](size, origin, wrap_x)
+
+
+# ============================================================================
+# Adjacency and distance
+# ============================================================================
+class HexAdjacency:
+    """
+    The neighbors of every hex on a grid, for movement and range finding.
+
+    Hexes are identified by their grid index (see grid.index() and
+    grid.hex_at()). The neighbors of hex i are
+    targets[offsets[i]:offsets[i + 1]], in the order of HexVector.UNIT,
+    leaving out the ones that are off the map. With wrap_x the last
+    column is joined to the first, and with wrap_y the last row of each
+    column to its first.
+
+    Distances, rings, ranges and lines are measured on the axial
+    coordinates of the hexes and don't follow the wrapping: they only
+    hold the hexes reached without crossing a wrapped edge. The
+    neighbors, and so the breadth first search and path finding, do
+    follow it.
+    """
+
+    def __init__(self, grid, wrap_x=False, wrap_y=False):
+        if (wrap_x or wrap_y) and not grid.wraps:
+            raise ValueError("{} maps do not wrap".format(
+                type(grid).__name__))
+        self._grid = grid
+        self._wrap_x = wrap_x
+        self._wrap_y = wrap_y
+
+        self.q = array('i')
+        self.r = array('i')
+        for hexloc in grid.hexes:
+            (q, r) = grid.axial(hexloc)
+            self.q.append(q)
+            self.r.append(r)
+
+        self._index = {qr: i for (i, qr) in enumerate(zip(self.q, self.r))}
+
+        units = [(unit.hx, unit.hy) for unit in HexVector.UNIT]
+        self.offsets = array('i', [0])
+        self.targets = array('i')
+        for (q, r) in zip(self.q, self.r):
+            for (dq, dr) in units:
+                n = self.locate(q + dq, r + dr)
+                if n is not None:
+                    self.targets.append(n)
+            self.offsets.append(len(self.targets))
+
+    @property
+    def grid(self):
+        return self._grid
+
+    def __len__(self):
+        return len(self.q)
+
+    def locate(self, q, r):
+        """
+        The index of the hex at axial coordinates, or None if it is off
+        the map
+        """
+        i = self._index.get((q, r))
+        if i is not None or not (self._wrap_x or self._wrap_y):
+            return i
+        grid = self._grid
+        (col, row) = grid.offset(grid.from_axial(q, r))
+        if self._wrap_x:
+            col %= grid.size.hx
+        if self._wrap_y:
+            row %= grid.size.hy
+        hexloc = grid.hex_at_offset(col, row)
+        if hexloc in grid:
+            return grid.index(hexloc)
+        return None
+
+    def neighbors(self, i):
+        """
+        The indices of the hexes next to hex i
+        """
+        return self.targets[self.offsets[i]:self.offsets[i + 1]]
+
+    def distance(self, a, b):
+        """
+        The number of steps between two hexes
+        """
+        dq = self.q[b] - self.q[a]
+        dr = self.r[b] - self.r[a]
+        return max(abs(dq), abs(dr), abs(dr - dq))
+
+    def distances(self, a):
+        """
+        The number of steps from a hex to every hex, by index. A NumPy
+        array when NumPy is available.
+        """
+        if load_numpy() is None:
+            (q0, r0) = (self.q[a], self.r[a])
+            return [max(abs(q - q0), abs(r - r0), abs(r - r0 - q + q0))
+                    for (q, r) in zip(self.q, self.r)]
+        q = numpy.frombuffer(self.q, dtype=numpy.intc) - self.q[a]
+        r = numpy.frombuffer(self.r, dtype=numpy.intc) - self.r[a]
+        return numpy.maximum(numpy.maximum(abs(q), abs(r)), abs(r - q))
+
+    def _collect(self, coords):
+        """
+        The indices of the hexes at the coordinates that are on the map.
+        Coordinates past a wrapped edge are left out like any others, so
+        that the hexes found agree with distance().
+        """
+        index = self._index
+        found = {}
+        for (q, r) in coords:
+            n = index.get((q, r))
+            if n is not None:
+                found[n] = True
+        return list(found)
+
+    def ring(self, center, radius):
+        """
+        The hexes at exactly radius steps from the center hex
+        """
+        if radius == 0:
+            return [center]
+        return self._collect(self._ring(center, radius))
+
+    def _ring(self, center, radius):
+        # Start at the corner in direction 4 and walk each side in turn
+        q = self.q[center] + HexVector.UNIT[4].hx * radius
+        r = self.r[center] + HexVector.UNIT[4].hy * radius
+        for unit in HexVector.UNIT:
+            for step in range(radius):
+                yield (q, r)
+                q += unit.hx
+                r += unit.hy
+
+    def within(self, center, radius):
+        """
+        The hexes at most radius steps from the center hex
+        """
+        (q0, r0) = (self.q[center], self.r[center])
+        return self._collect(
+            (q0 + dq, r0 + dr)
+            for dq in range(-radius, radius + 1)
+            for dr in range(max(-radius, dq - radius),
+                            min(radius, dq + radius) + 1))
+
+    def line(self, a, b):
+        """
+        The hexes on the straight line from hex a to hex b, including both.
+        Hexes off the map are left out.
+        """
+        steps = self.distance(a, b)
+        # Nudge the line off the hex corners so ties round the same way
+        q0 = self.q[a] + 1e-6
+        r0 = self.r[a] + 2e-6
+        (dq, dr) = (self.q[b] - self.q[a], self.r[b] - self.r[a])
+        coords = [self.cube_round(q0 + dq * t / steps, r0 + dr * t / steps)
+                  for t in range(1, steps)]
+        return [a] + self._collect(coords) + ([b] if steps else [])
+
+    def visible(self, a, b, blocked):
+        """
+        Is there a line of sight from hex a to hex b? blocked is a
+        container of the indices of hexes that block it. The ends of the
+        line don't.
+        """
+        return not any(n in blocked for n in self.line(a, b)[1:-1])
+
+    @staticmethod
+    def cube_round(q, r):
+        """
+        The axial coordinates of the hex holding a fractional position
+        """
+        s = r - q
+        (rq, rr, rs) = (round(q), round(r), round(s))
+        (eq, er, es) = (abs(rq - q), abs(rr - r), abs(rs - s))
+        # Fix the coordinate that was rounded furthest
+        if eq > er and eq > es:
+            rq = rr - rs
+        elif er > es:
+            rr = rq + rs
+        return (rq, rr)
+
+    def bfs(self, start, passable=None, limit=None):
+        """
+        The number of steps from the start hex to every hex, by index,
+        moving only through passable hexes. passable is a container of
+        indices, or None for all of them. Unreachable hexes, and those
+        more than limit steps away, are -1.
+        """
+        (steps, parents) = self._search(start, passable, limit)
+        return steps
+
+    def path(self, start, goal, passable=None):
+        """
+        The indices of the hexes on a shortest path from start to goal,
+        including both, or None if there isn't one
+        """
+        (steps, parents) = self._search(start, passable, None, goal)
+        if steps[goal] < 0:
+            return None
+        path = [goal]
+        while path[-1] != start:
+            path.append(parents[path[-1]])
+        path.reverse()
+        return path
+
+    def _search(self, start, passable, limit, goal=None):
+        offsets = self.offsets
+        targets = self.targets
+        steps = [-1] * len(self)
+        parents = [-1] * len(self)
+        steps[start] = 0
+        frontier = [start]
+        depth = 0
+        while frontier and (limit is None or depth < limit):
+            depth += 1
+            following = []
+            for i in frontier:
+                for n in targets[offsets[i]:offsets[i + 1]]:
+                    if steps[n] < 0 and (passable is None or n in passable):
+                        steps[n] = depth
+                        parents[n] = i
+                        following.append(n)
+            if goal is not None and steps[goal] >= 0:
+                break
+            frontier = following
+        return (steps, parents)
+
+
+# ============================================================================
+# Megahexes
+#   Groups of hexes within a radius of a center hex, outlined over the map
+# ============================================================================
+class Megahexes:
+    """
+    The megahexes of a radius tile the plane: radius 1 gives the 7 hex
+    megahexes of The Fantasy Trip. In the axial coordinates of the grids
+    their centers are the lattice points a * v1 + b * v2, with
+    v1 = (2r + 1, r + 1) and v2 = (r, 2r + 1), and the megahex at
+    a = b = 0 is centered on the grid origin.
+    """
+
+    def __init__(self, radius=1):
+        self.radius = radius
+        self.v1 = (2 * radius + 1, radius + 1)
+        self.v2 = (radius, 2 * radius + 1)
+        # The number of hexes in each megahex
+        self.area = 3 * radius * (radius + 1) + 1
+
+    def center(self, a, b):
+        """
+        The axial coordinates of the center of a megahex
+        """
+        return (a * self.v1[0] + b * self.v2[0], a * self.v1[1] + b * self.v2[1])
+
+    def locate(self, q, r):
+        """
+        The lattice coordinates (a, b) of the megahex holding the hex at
+        axial coordinates (q, r)
+        """
+        # Solve (q, r) = a * v1 + b * v2 and round to the nearest point.
+        # The megahex is that one or one of its neighbours.
+        (n, half) = (self.area, self.area // 2)
+        a = (self.v2[1] * q - self.v2[0] * r + half) // n
+        b = (self.v1[0] * r - self.v1[1] * q + half) // n
+        for (da, db) in self._nearby:
+            (cq, cr) = self.center(a + da, b + db)
+            (dq, dr) = (q - cq, r - cr)
+            if max(abs(dq), abs(dr), abs(dr - dq)) <= self.radius:
+                return (a + da, b + db)
+        raise ValueError("no megahex holds ({}, {})".format(q, r))
+
+    _nearby = [(0, 0), (1, 0), (-1, 0), (0, 1), (0, -1), (1, -1), (-1, 1)]
+
+    @staticmethod
+    def stroke_style(stroke):
+        """
+        The line style of the megahex outlines, heavier than the hexes
+        """
+        return ('stroke:#000000; stroke-width:'
+                + output_format.number(2 * stroke) + ';stroke-linecap:round')
+
+
+class MegahexEdgeSet(HexEdgeSet):
+    """
+    The outlines of the megahexes over a set of tiles. Every border
+    segment is added by the one or two tiles on either side of it. When
+    both are in the same megahex the segment is inside it and cancels
+    out, so only the outlines are left, each segment once.
+    """
+
+    def __init__(self, tile=HexTile):
+        HexEdgeSet.__init__(self, tile)
+        self._owners = {}
+
+    def add(self, lattice, side='interior', megahex=None):
+        """
+        Add the border segments of the tile centered at a lattice point,
+        which is part of the megahex
+        """
+        for (key, segment) in tile_segments(lattice, side, self._tile):
+            owner = self._owners.get(key)
+            if owner is None:
+                self._owners[key] = megahex
+                self._edges[key] = segment
+            elif owner == megahex:
+                self._edges.pop(key, None)
+
+
+class HexLayout(namedtuple('HexLayout', [
+        'size', 'tile_size', 'tile_step', 'origin', 'padding',
+        'stroke_width', 'orientation', 'horizontal', 'grid',
+        'viewport', 'culled', 'region'])):
+    """
+    The resolved placement of a grid on a canvas.
+
+    All of the dimensions are computed once by HexCanvas and never change
+    for the rest of the run, so locating a tile is just a few
+    multiply-adds instead of a walk through the HexCanvas properties.
+
+    The viewport is the visible part of the canvas as (x0, y0, x1, y1).
+    When the map may reach outside of it the layout is culled and only
+    the tiles that overlap the viewport are drawn.
+
+    A layout for one region of the map draws only the hexes in a block of
+    columns and rows, (first column, end column, first row, end row)
+    counted from the first hex of the map.
+    """
+
+    __slots__ = ()
+
+    def tile_center(self, hexloc):
+        """
+        Find the center point of a tile on the grid
+        Multiply the hexloc coords by the tile_step and add the tile_origin
+        """
+        p = self.grid.translate(hexloc - self.grid.origin)
+        x = self.origin.x + p.x * self.tile_step.x
+        y = self.origin.y + p.y * self.tile_step.y
+        if self.horizontal:
+            return Point(y, x)
+        return Point(x, y)
+
+    def tile_lattice(self, hexloc):
+        """
+        The center of a tile as whole numbers of hexrun and hexrise from
+        the origin tile
+        """
+        p = self.grid.translate(hexloc - self.grid.origin)
+        return (int(round(p.x * 3)), int(round(p.y * 2)))
+
+    def lattice_point(self, lattice):
+        """
+        Convert a point on the hexrun/hexrise lattice to canvas coordinates
+        """
+        x = self.origin.x + lattice[0] * self.tile_size.x
+        y = self.origin.y + lattice[1] * self.tile_size.y
+        if self.horizontal:
+            return Point(y, x)
+        return Point(x, y)
+
+    def center_array(self, hx, hy):
+        """
+        Find the center points of arrays of hex locations.
+        Returns two arrays with the x and y canvas coordinates
+        """
+        (px, py) = self.grid.translate_array(hx - self.grid.origin.hx,
+                                             hy - self.grid.origin.hy)
+        x = self.origin.x + px * self.tile_step.x
+        y = self.origin.y + py * self.tile_step.y
+        if self.horizontal:
+            return (y, x)
+        return (x, y)
+
+    def hexes(self):
+        """
+        Iterate over the hexes to draw: all of the grid, or just the ones
+        in the region and overlapping the viewport
+        """
+        if phase_timer.enabled:
+            return phase_timer.timed('hexes', self._hexes())
+        return self._hexes()
+
+    def _hexes(self):
+        if self.culled or self.region is not None:
+            return self._visible_hexes()
+        return self.grid.hexes
+
+    def _visible_hexes(self):
+        """
+        The columns of every grid are one hex step apart and the hexes in
+        a column one row step apart, so the visible ones are found from
+        the first hex of each column without looking at the others.
+        """
+        grid = self.grid
+        (first_col, end_col, first_row, end_row) = (
+            self.region or (0, grid.size.hx, 0, None))
+
+        if self.culled:
+            (x0, y0, x1, y1) = self.viewport
+            if self.horizontal:
+                (x0, y0, x1, y1) = (y0, x0, y1, x1)
+
+            # A tile reaches two runs and one rise from its center
+            reach_x = 2 * self.tile_size.x + self.stroke_width
+            reach_y = self.tile_size.y + self.stroke_width
+            (step_x, step_y) = (self.tile_step.x, self.tile_step.y)
+
+            left = grid.translate(grid.hex_at_offset(0, 0) - grid.origin).x
+            first_col = max(first_col, math.ceil(
+                (x0 - reach_x - self.origin.x) / step_x - left))
+            end_col = min(end_col, math.floor(
+                (x1 + reach_x - self.origin.x) / step_x - left) + 1)
+
+        for col in range(first_col, end_col):
+            (top_row, bottom_row) = (first_row, grid.column_length(col))
+            if end_row is not None:
+                bottom_row = min(bottom_row, end_row)
+            if self.culled:
+                top = grid.translate(grid.hex_at_offset(col, 0)
+                                     - grid.origin).y
+                top_row = max(top_row, math.ceil(
+                    (y0 - reach_y - self.origin.y) / step_y - top))
+                bottom_row = min(bottom_row, math.floor(
+                    (y1 + reach_y - self.origin.y) / step_y - top) + 1)
+            for row in range(top_row, bottom_row):
+                yield grid.hex_at_offset(col, row)
+
+    def bounds(self):
+        """
+        The canvas box (x0, y0, x1, y1) that holds the tiles to draw,
+        or None if there are none
+        """
+        reach = Point(2 * self.tile_size.x + self.stroke_width,
+                      self.tile_size.y + self.stroke_width)
+        if self.horizontal:
+            reach = reach.swap
+        box = None
+        for (hexloc, center) in self.tile_centers():
+            if box is None:
+                box = [center.x, center.y, center.x, center.y]
+            box = [min(box[0], center.x), min(box[1], center.y),
+                   max(box[2], center.x), max(box[3], center.y)]
+        if box is None:
+            return None
+        return (box[0] - reach.x, box[1] - reach.y,
+                box[2] + reach.x, box[3] + reach.y)
+
+    def regions(self, columns, rows):
+        """
+        Split the map into blocks of columns and rows, each a layout of
+        its own. 0 keeps all of the columns or rows in one block.
+        """
+        size = self.grid.size
+        columns = columns or size.hx
+        rows = rows or size.hy
+        for first_col in range(0, size.hx, columns):
+            for first_row in range(0, size.hy, rows):
+                yield self._replace(region=(
+                    first_col, min(first_col + columns, size.hx),
+                    first_row, min(first_row + rows, size.hy)))
+
+    def element_id(self, name):
+        """
+        The id of an element drawn once for the layout, made unique to
+        its region
+        """
+        if self.region is None:
+            return name
+        return '%s-%d-%d' % (name, self.region[0], self.region[2])
+
+    def tile_centers(self, block=4096):
+        """
+        Iterate over the hexes of the grid with the center of each tile.
+        With NumPy the centers are computed a block of columns at a time,
+        otherwise each one is located in turn.
+        """
+        if phase_timer.enabled:
+            return phase_timer.timed('hexes', self._tile_centers(block))
+        return self._tile_centers(block)
+
+    def _tile_centers(self, block):
+        # A region of whole columns is computed just like the whole map
+        (first_col, end_col, first_row, end_row) = (
+            self.region or (0, self.grid.size.hx, 0, self.grid.size.hy))
+        # A map smaller than one block doesn't pay for importing NumPy
+        small = (end_col - first_col) * (end_row - first_row) < block
+        if (small or self.culled
+                or first_row > 0 or end_row < self.grid.size.hy
+                or load_numpy() is None):
+            for hexloc in self._hexes():
+                yield (hexloc, self.tile_center(hexloc))
+            return
+
+        # Keep the arrays to roughly the block size on any shape of map
+        columns = max(1, block // max(1, self.grid.size.hy))
+        for first in range(first_col, end_col, columns):
+            count = min(columns, end_col - first)
+            (hx, hy) = self.grid.hex_array(first, count)
+            (x, y) = self.center_array(hx, hy)
+            for (h, k, cx, cy) in zip(hx.tolist(), hy.tolist(),
+                                      x.tolist(), y.tolist()):
+                yield (HexVector(h, k), Point(cx, cy))
+
+
+class HexCanvas:
+    """
+    Draw the tiles on the SVG document
+    """
+
+    def __init__(self, svg, map_spec, size=None):
+        """
+        Store and initialize the elements to draw the map.
+        Without an svg document the canvas size must be given in user units
+        """
+        self._svg = svg
+        self._spec = map_spec
+        self._page_size = size
+        self._layout = None
+
+    @property
+    def layout(self):
+        """
+        The resolved layout, computed on first use
+        """
+        if self._layout is None:
+            self._layout = self._resolve_layout()
+        return self._layout
+
+    def _resolve_layout(self):
+        """
+        Compute every canvas dimension exactly once
+        """
+        size = self._canvas_size()
+        hexsize = self._hexsize()
+        if hexsize:
+            tile_size = Point(hexsize / 4, hexsize / 4 * 2 * 0.8660254)
+            stroke = self._tile_stroke_width(tile_size)
+        else:
+            stroke = self._stroke_width(size)
+            tile_size = self._tile_size(size, stroke)
+        padding = self._padding(size, tile_size)
+        origin = self._tile_origin(tile_size, stroke, padding)
+        viewport = self._viewport(size)
+
+        # A map fitted to a fully visible canvas is entirely visible
+        page = self._canvas_size(False)
+        culled = bool(hexsize or self._spec['window_col']
+                      or self._spec['window_row']
+                      or viewport[0] > 0 or viewport[1] > 0
+                      or viewport[2] < page.x * 0.999999
+                      or viewport[3] < page.y * 0.999999)
+
+        return HexLayout(
+            size=size,
+            tile_size=tile_size,
+            tile_step=tile_size * Point(3, 2),
+            origin=origin,
+            padding=padding,
+            stroke_width=stroke,
+            orientation=self._spec['orientation'],
+            horizontal=self._spec['orientation'] == 'horizontal',
+            grid=self.grid,
+            viewport=viewport,
+            culled=culled,
+            region=None)
+
+    def _canvas_size(self, oriented=True):
+        """
+        Read the size of the svg canvas as a Point object
+        """
+        if self._svg is None:
+            size = self._page_size
+        else:
+            unit = self._svg.unittouu
+            size = Point(float(unit(self._svg.get('width'))),
+                         float(unit(self._svg.get('height'))))
+        if oriented and self._spec['orientation'] == 'horizontal':
+            size = size.swap
+        return size
+
+    def _viewport(self, size):
+        """
+        The visible part of the canvas from the document viewBox, or the
+        whole canvas
+        """
+        if self._svg is not None and self._svg.get('viewBox'):
+            (x, y, width, height) = self._svg.get_viewbox()
+            return (x, y, x + width, y + height)
+        size = self._canvas_size(False)
+        return (0, 0, size.x, size.y)
+
+    def _hexsize(self):
+        """
+        The width of a hex in user units when it is set instead of fitting
+        the map to the canvas, or 0
+        """
+        hexsize = self._spec['tile_size']
+        if not hexsize or self._svg is None:
+            return hexsize
+        return self._svg.unittouu('%s%s' % (hexsize, self._spec['units']))
+
+    @property
+    def size(self):
+        """
+        Return the size of the svg canvas as a Point object
+        """
+        return self.layout.size
+
+    @property
+    def grid(self):
+        return self._spec['grid']
+
+    def _stroke_width(self, csize):
+        """
+        Define the stroke width as a percentage of the size of one hex
+        """
+        if self._spec['orientation'] == 'vertical':
+            return (self._spec['stroke_width'] / self.grid.size.hx) * csize.x
+        else:
+            return (self._spec['stroke_width'] / self.grid.size.hy) * csize.y
+
+    def _tile_stroke_width(self, tile_size):
+        """
+        Define the stroke width as a percentage of the size of one hex
+        when the hex size is set
+        """
+        if self._spec['orientation'] == 'vertical':
+            return self._spec['stroke_width'] * tile_size.x * 3
+        else:
+            return self._spec['stroke_width'] * tile_size.y * 2
+
+    @property
+    def stroke_width(self):
+        """
+        The width of lines drawn for borders and vertices.
+        A percentage of the total width or height of a hex
+        """
+        return self.layout.stroke_width
+
+    def _tile_size(self, csize, stroke):
+        """
+        Fit the hexgrid into the canvas dimensions
+        """
+        # TODO - Adjust for brick and square tiles
+
+        # hexrun is the basic dimension of a hex
+        # it is 1/2 of a hexside and 1/4 of the longest 'diameter' of a hex
+        if self._spec['wrap_x']:
+            hexrun = csize.x / ((self.grid.size.hx - 1) * 3)
+        else:
+            hexrun = (csize.x - stroke) / ((self.grid.size.hx * 3) + 1)
+
+        # The height of a hex is cos(pi/6) * the width
+        # hexrise is 1/2 of a hex height
+        hexrise = (hexrun * 2) * 0.8660254
+
+        # TODO - check the canvas y as well and pick the smallest dimension
+        #        that allows the entire hexgrid to pack within the canvas
+        if hexrise * ((self.grid.size.hy * 2) + 1) > csize.y:
+            hexrise = (csize.y - stroke) / ((self.grid.size.hy * 2) + 1)
+            hexrun = hexrise / ( 2 * 0.8660254 )
+
+        return Point(hexrun, hexrise)
+
+    @property
+    def tile_size(self):
+        """
+        Determine the hexrise and hexrun dimensions of a hex by fitting
+        a hexgrid into the canvas dimensions.
+        Hexes pack so that the columns are only 3/4 as wide as one hex
+        dim.x = hexrun = hexside / 2 = hexwidth / 4
+        dim.y = hexrise = hexheight / 2
+        """
+        return self.layout.tile_size
+
+    def _padding(self, s, tdim):
+        """
+        Split the unused canvas space evenly on both sides of the grid
+        """
+        if self._spec['wrap_x'] is False:
+            msize = Point(tdim.x * ((self.grid.size.hx * 3) + 1),
+                          tdim.y * ((self.grid.size.hy * 2) + 1))
+
+        else:
+            msize = Point(tdim.x * ((self.grid.size.hx - 1) * 3),
+                          tdim.y * ((self.grid.size.hy * 2) + 1))
+
+        # A map larger than the canvas starts at its corner
+        excess = (s - msize)
+        pad = Point(max(0, excess.x / 2), max(0, excess.y / 2))
+
+        return pad
+
+    @property
+    def padding(self):
+        """
+        Determine how much space exists on the page outside the boundaries
+        of the hex grid
+        """
+        return self.layout.padding
+
+    def _tile_origin(self, dim, stroke, padding):
+        """
+        Place the origin tile inside the stroke and optional padding
+        """
+        # offset to center the map on the page
+        offset_x = 0 if self._spec['wrap_x'] else dim.x * 2
+        origin = Point(offset_x, dim.y * 2) + Point(stroke/2, stroke/2)
+        if self._spec['pad']:
+            origin += padding
+        # Scroll the window column and row to the corner of the canvas
+        window = Point(self._spec['window_col'], self._spec['window_row'])
+        if window != Point(0, 0):
+            origin += Point(-window.x * dim.x * 3, -window.y * dim.y * 2)
+        return origin
+
+    @property
+    def tile_origin(self):
+        """
+        Find the center point of the origin tile on the canvas
+        """
+        return self.layout.origin
+
+    @property
+    def tile_step(self):
+        """
+        This a vector where the two coordinates correspond to the
+        horizontal and vertical distance between one hex and the next in
+        each dimension
+        """
+        return self.layout.tile_step
+
+    def tile_center(self, hexloc):
+        """
+        Find the center point of a tile on the grid
+        """
+        return self.layout.tile_center(hexloc)
+
+# -------------------------------------------------------------------------
+# Map drawing
+#   Each output mode is a generator of the elements for the map layer, in
+#   drawing order. Anything shared between tiles goes into the defs.
+# -------------------------------------------------------------------------
+
+def shared_edges(layout):
+    """
+    Collect the border segments of every tile in the grid
+    """
+    edges = HexEdgeStream(layout)
+    for hexloc in layout.hexes():
+        edges.add(layout.tile_lattice(hexloc), layout.grid.edge(hexloc))
+    return edges
+
+def shared_vertices(layout, tic_size=0.25):
+    """
+    Collect the corners of every tile in the grid
+    """
+    vertices = HexVertexSet(layout, tic_size)
+    for hexloc in layout.hexes():
+        vertices.add(layout.tile_lattice(hexloc), layout.grid.edge(hexloc))
+    return vertices
+
+def draw_shared_borders(layout, spec):
+    """
+    Draw the borders that are shared between tiles once, beneath them.
+    Returns None when each tile draws its own.
+    """
+    if spec['border_style'] == 'shared':
+        borders = shared_edges(layout).draw(layout.stroke_width)
+        borders.set('id', layout.element_id('hexmap-edges'))
+    elif spec['border_style'] == 'shared-vertex':
+        borders = shared_vertices(layout, spec['tic_size']).draw(
+            layout.stroke_width)
+        borders.set('id', layout.element_id('hexmap-tics'))
+    else:
+        return None
+    return borders
+
+def draw_tiles(layout, spec, defs=None):
+    """
+    Draw each hex as a group with its own border and dot
+    """
+    # Shared borders are drawn once beneath the tiles
+    borders = draw_shared_borders(layout, spec)
+    if borders is not None:
+        yield borders
+
+    for element in tile_elements(layout, spec, layout.tile_centers()):
+        yield element
+
+def tile_elements(layout, spec, tile_centers):
+    """
+    Draw the tile groups and labels of the hexes at the tile centers.
+    Any shared borders are left to the caller.
+    """
+    # Hoist the per-map drawing parameters out of the tile loop
+    tilesize = layout.tile_size
+    stroke = layout.stroke_width
+    orientation = layout.orientation
+    border_style = spec['border_style']
+    if border_style in ['shared', 'shared-vertex']:
+        border_style = 'none'
+    tic_size = spec['tic_size']
+    center_dot = spec['center_dot']
+    label = spec['label']
+    labels = HexLabels(spec['label_spec'], layout.grid, tilesize.y/5,
+                       spec['label_mode'], layout.element_id('hexlabels'))
+
+    # draw all of the hexes in the grid
+    for (hexloc, center) in tile_centers:
+
+        #if shift:
+        edge = layout.grid.edge(hexloc)
+        # else: edge = 'interior'
+
+        tile = HexTile(center, tilesize, edge)
+        group = tile.draw(stroke, orientation, border_style, tic_size,
+                          center_dot)
+        # A tile without its own border or dot draws nothing
+        if len(group):
+            group.set('id', hex_id('hex', hexloc))
+            yield group
+        if label:
+            for element in labels.add(hexloc, edge, tile.label_center):
+                yield element
+
+    for element in labels.finish():
+        yield element
+
+def draw_paths(layout, spec, defs=None):
+    """
+    Draw all of the borders as one path and all of the dots as another
+    """
+    tilesize = layout.tile_size
+
+    paths = HexPaths(layout, spec['border_style'], spec['tic_size'],
+                     spec['center_dot'])
+    names = HexLabels(spec['label_spec'], layout.grid, tilesize.y/5,
+                      spec['label_mode'], layout.element_id('hexlabels'))
+    labels = []
+    for (hexloc, center) in layout.tile_centers():
+        edge = layout.grid.edge(hexloc)
+        tile = HexTile(center, tilesize, edge)
+        paths.add(hexloc, tile, edge)
+        if spec['label']:
+            labels.extend(names.add(hexloc, edge, tile.label_center))
+    labels.extend(names.finish())
+
+    group = paths.draw(layout.stroke_width)
+    group.set('id', layout.element_id('hexmap-paths'))
+    yield group
+    for label in labels:
+        yield label
+
+def draw_symbols(layout, spec, defs):
+    """
+    Draw each distinct tile once and place every hex as a reference
+    to it
+    """
+    tilesize = layout.tile_size
+    stroke = layout.stroke_width
+
+    border_style = spec['border_style']
+    borders = draw_shared_borders(layout, spec)
+    if borders is not None:
+        yield borders
+        border_style = 'none'
+
+    symbols = HexSymbols(defs, tilesize, stroke, layout.orientation,
+                         border_style, spec['tic_size'], spec['center_dot'])
+
+    # Declare xlink once for all of the references
+    tiles = etree.Element('g', nsmap={'xlink': NSS['xlink']})
+    tiles.set('id', layout.element_id('hexmap-tiles'))
+    names = HexLabels(spec['label_spec'], layout.grid, tilesize.y/5,
+                      spec['label_mode'], layout.element_id('hexlabels'))
+    labels = []
+
+    for (hexloc, center) in layout.tile_centers():
+        edge = layout.grid.edge(hexloc)
+        use = symbols.place(center, edge)
+        if use is not None:
+            use.set('id', hex_id('hex', hexloc))
+            tiles.append(use)
+        if spec['label']:
+            tile = HexTile(center, tilesize, edge)
+            labels.extend(names.add(hexloc, edge, tile.label_center))
+    labels.extend(names.finish())
+
+    if len(tiles):
+        yield tiles
+    for label in labels:
+        yield label
+
+def draw_pattern(layout, spec, defs):
+    """
+    Fill the outline of the map with one repeating cell of the grid
+    """
+    # Only an unlabelled rectangle grid without half hexes repeats
+    if (type(spec['grid']) is not HexGridRectangle or spec['label']
+            or spec['wrap_x']):
+        sys.stderr.write('The pattern output needs an unlabelled '
+                         'rectangle grid without wrapping. '
+                         'Drawing individual tiles instead.\n')
+        for element in draw_tiles(layout, spec, defs):
+            yield element
+        return
+
+    # A single cell has nothing to share
+    border_style = {'shared': 'solid', 'shared-vertex': 'vertex'}.get(
+        spec['border_style'], spec['border_style'])
+
+    pattern = HexPattern(layout, border_style, spec['tic_size'],
+                         spec['center_dot'])
+    fill = pattern.draw(pattern.define(defs))
+    fill.set('id', 'hexmap-fill')
+    yield fill
+
+renderers = {
+    'tiles': draw_tiles,
+    'path': draw_paths,
+    'symbol': draw_symbols,
+    'pattern': draw_pattern
+}
+
+def chunked(spec):
+    """
+    Is the map split into regions? A pattern has no tiles to split.
+    """
+    return ((spec['chunk_cols'] or spec['chunk_rows'])
+            and spec['output_mode'] != 'pattern')
+
+def parallel(spec):
+    """
+    Can the tiles be drawn by a pool of processes? Only separate tiles
+    are drawn one column at a time without anything carried between
+    them. A single label element and shared style classes span the
+    whole map.
+    """
+    return (spec['jobs'] > 1 and spec['output_mode'] == 'tiles'
+            and not chunked(spec) and not spec['style_classes']
+            and not (spec['label'] and spec['label_mode'] == 'single'))
+
+def map_renderer(spec):
+    """
+    The generator of the elements of the whole map layer
+    """
+    if chunked(spec):
+        return draw_regions
+    if parallel(spec):
+        return draw_parallel
+    return renderers[spec['output_mode']]
+
+def column_ranges(columns, jobs):
+    """
+    Split the columns into a few ranges for each job, so that a job
+    which finishes early can take another
+    """
+    count = max(1, min(columns, jobs * 4))
+    bounds = [columns * n // count for n in range(count + 1)]
+    return list(zip(bounds, bounds[1:]))
+
+def draw_column_range(layout, spec, first_col, end_col):
+    """
+    Draw the tiles of a range of columns in a worker process. Returns
+    the elements serialized as one fragment, and the timing of the work.
+    """
+    start = time.perf_counter()
+    output_format.configure(spec['precision'], spec['relative_paths'])
+    centers = layout._replace(
+        region=(first_col, end_col, 0, layout.grid.size.hy)).tile_centers()
+    fragment = etree.Element('fragment')
+    fragment.extend(list(tile_elements(layout, spec, centers)))
+    data = etree.tostring(fragment)
+    return (data, {
+        'columns': [first_col, end_col],
+        'pid': os.getpid(),
+        'elements': len(fragment),
+        'seconds': time.perf_counter() - start
+    })
+
+def draw_parallel(layout, spec, defs=None):
+    """
+    Draw the tiles in a pool of spec['jobs'] processes, each drawing a
+    range of columns. The fragments are put back together in column
+    order, so the map is the same as one drawn by draw_tiles.
+    """
+    # Imported here, as multiprocessing slows every start of the effect
+    from concurrent.futures import ProcessPoolExecutor
+
+    borders = draw_shared_borders(layout, spec)
+    if borders is not None:
+        yield borders
+
+    # A column label is finished by the first tile of the next column, so
+    # the last label of a range follows the first tile group of the next
+    # one, or leads it when the tiles have no groups
+    carry = spec['label'] and spec['label_mode'] == 'column'
+    held = []
+
+    ranges = column_ranges(layout.grid.size.hx, spec['jobs'])
+    with ProcessPoolExecutor(max_workers=spec['jobs']) as pool:
+        jobs = [pool.submit(draw_column_range, layout, spec, first, end)
+                for (first, end) in ranges]
+        for job in jobs:
+            (data, timing) = job.result()
+            phase_timer.add_worker(timing)
+            elements = list(etree.fromstring(data))
+            if carry and elements:
+                first = 1 if local_name(elements[0]) == 'g' else 0
+                elements[first:first] = held
+                held = [elements.pop()]
+            for element in elements:
+                yield element
+
+    for element in held:
+        yield element
+
+# Sub-layers declare their namespaces so they can be written on their own
+region_nsmap = {None: NSS['svg'], 'inkscape': NSS['inkscape']}
+
+def megahex_hexes(layout):
+    """
+    The hexes to outline megahexes over. When only part of the map is
+    drawn their neighbours are included, so that the segments on the
+    cut cancel like the others. The extra outlines are off the page.
+    """
+    grid = layout.grid
+    if not (layout.culled or layout.region is not None):
+        return grid.hexes
+    drawn = list(layout.hexes())
+    hexes = list(drawn)
+    seen = set(drawn)
+    for hexloc in drawn:
+        (q, r) = grid.axial(hexloc)
+        for unit in HexVector.UNIT:
+            near = grid.from_axial(q + unit.hx, r + unit.hy)
+            if near not in seen and near in grid:
+                seen.add(near)
+                hexes.append(near)
+    return hexes
+
+def draw_megahexes(layout, spec, defs=None):
+    """
+    Draw the outlines of the megahexes as a sub-layer of their own, so
+    the overlay can be hidden or locked apart from the map
+    """
+    megahexes = Megahexes(spec['megahex'])
+    outlines = MegahexEdgeSet()
+    grid = layout.grid
+    for hexloc in megahex_hexes(layout):
+        outlines.add(layout.tile_lattice(hexloc), grid.edge(hexloc),
+                     megahexes.locate(*grid.axial(hexloc)))
+
+    layer = createLayer('megahexes', region_nsmap)
+    layer.set('id', layout.element_id('hexmap-megahexes'))
+    layer.append(stroked_path(outlines.path_data(layout), 'megahex',
+                              Megahexes.stroke_style(layout.stroke_width)))
+    yield layer
+
+def draw_map(layout, spec, defs=None, draw=None):
+    """
+    Draw the whole map layer: the tiles with the renderer for the spec,
+    then any megahex overlay on top of them
+    """
+    draw = map_renderer(spec) if draw is None else draw
+    for element in draw(layout, spec, defs):
+        yield element
+    if spec['megahex']:
+        for element in draw_megahexes(layout, spec, defs):
+            yield element
+
+def draw_regions(layout, spec, defs):
+    """
+    Draw each block of chunk_cols columns by chunk_rows rows into a
+    sub-layer of its own, so regions of a large map can be hidden or
+    locked separately
+    """
+    draw = renderers[spec['output_mode']]
+    for region in layout.regions(spec['chunk_cols'], spec['chunk_rows']):
+        # Skip blocks that are all culled or outside of a radial map
+        if next(iter(region.hexes()), None) is None:
+            continue
+        (first_col, end_col, first_row, end_row) = region.region
+        sublayer = createLayer('hexmap %d-%d,%d-%d' % (
+            first_col, end_col - 1, first_row, end_row - 1), region_nsmap)
+        sublayer.set('id', region.element_id('hexmap-region'))
+        sublayer.extend(draw(region, spec, defs))
+        yield sublayer
+
+# -------------------------------------------------------------------------
+# Headless output
+# -------------------------------------------------------------------------
+
+# The map_spec values used when a headless map leaves them out. The grid is
+# described by its size and origin instead of a grid object.
+map_defaults = {
+    'geometry': 'rectangle',
+    'size_hx': 10,
+    'size_hy': 10,
+    'origin_hx': 0,
+    'origin_hy': 0,
+    'orientation': 'vertical',
+    'pad': True,
+    'tile_size': 0.0,
+    'tile_shape': 'hex',
+    'border_style': 'solid',
+    'tic_size': 0.125,
+    'center_dot': True,
+    'label': True,
+    'label_mode': 'text',
+    'output_mode': 'tiles',
+    'wrap_x': False,
+    'wrap_y': False,
+    'reverse_x': False,
+    'reverse_y': False,
+    'sawtooth': False,
+    'units': 'mm',
+    'stroke_width': 0.025,
+    'precision': 6,
+    'relative_paths': False,
+    'style_classes': False,
+    'window_col': 0,
+    'window_row': 0,
+    'clip': False,
+    'chunk_cols': 0,
+    'chunk_rows': 0,
+    'chunk_files': False,
+    'jobs': 1,
+    'megahex': 0
+}
+
+# The label_spec values used when a map leaves them out
+label_defaults = {
+    'seperator': ',',
+    'alphacolumn': False,
+    'zeropad': True,
+    'invert': False,
+    'reverse_row': False,
+    # The first column is A with alphacolumn, as in the extension dialog
+    'colstart': 1,
+    'rowstart': 0
+}
+
+def make_label_spec(params, size):
+    """
+    Build a label spec from a dict with any of the label_defaults keys.
+    The digits of each label field are sized to fit the map
+    """
+    spec = dict(label_defaults)
+    spec.update(params)
+    spec['hxdigits'] = max(2, nrdigits(size.hx + spec['colstart']))
+    spec['hydigits'] = max(2, nrdigits(size.hy + spec['rowstart']))
+    return spec
+
+def make_map_spec(params):
+    """
+    Build a map spec from a dict with any of the map_defaults and
+    label_defaults keys
+    """
+    spec = dict(map_defaults)
+    spec.update((k, v) for (k, v) in params.items()
+                if k not in label_defaults)
+    spec['grid'] = make_grid(
+        spec['geometry'],
+        HexVector(spec['size_hx'], spec['size_hy']),
+        HexVector(spec['origin_hx'], spec['origin_hy']),
+        spec['wrap_x'], spec['sawtooth'])
+    spec['label_spec'] = make_label_spec(
+        {k: v for (k, v) in params.items() if k in label_defaults},
+        spec['grid'].size)
+    return spec
+
+def write_hexmap(output, map_spec, width, height, units='mm'):
+    """
+    Write an SVG document holding just a hexmap layer without building
+    the document in memory. Each element is serialized and released as
+    soon as it is drawn. Tiles with their own borders hold only one tile
+    at a time. Shared borders and the paths and symbols modes write one
+    path for the whole map, which is held until it is drawn, so memory
+    use grows with the size of that path but not with a set of every
+    segment or corner.
+
+    The width and height are the page size in the given units, which
+    are also the document user units.
+    """
+    output_format.configure(map_spec['precision'], map_spec['relative_paths'])
+    output_styles.configure(map_spec['style_classes'])
+    layout = HexCanvas(None, map_spec, Point(width, height)).layout
+    _write_svg(output, layout, map_spec, draw_map, (0, 0, width, height),
+               units)
+
+def write_hexmap_regions(output, map_spec, width, height, units='mm'):
+    """
+    Write each region of the map to an SVG document of its own, named
+    after the output file with the first column and row of the region.
+    The whole map is laid out on the page as usual and every document
+    shows its part of it, so they share one coordinate frame.
+    Returns the list of file names.
+    """
+    output_format.configure(map_spec['precision'], map_spec['relative_paths'])
+    output_styles.configure(map_spec['style_classes'])
+    # Every region is drawn even if it is off the page
+    layout = HexCanvas(None, map_spec, Point(width, height)).layout._replace(
+        culled=False)
+    draw = partial(draw_map, draw=renderers[map_spec['output_mode']])
+    (stem, ext) = os.path.splitext(output)
+
+    filenames = []
+    for region in layout.regions(map_spec['chunk_cols'], map_spec['chunk_rows']):
+        box = region.bounds()
+        if box is None:
+            continue
+        (x0, y0, x1, y1) = box
+        box = (round(x0, 6), round(y0, 6), round(x1 - x0, 6), round(y1 - y0, 6))
+        filename = '%s-%d-%d%s' % (stem, region.region[0], region.region[2], ext)
+        with open(filename, 'wb') as f:
+            _write_svg(f, region, map_spec, draw, box, units)
+        filenames.append(filename)
+    return filenames
+
+def _write_svg(output, layout, map_spec, draw, box, units):
+    """
+    Stream an SVG document showing the box (x, y, width, height) of the
+    canvas
+    """
+    (x, y, width, height) = box
+    defs = etree.Element(addNS('defs', 'svg'), nsmap={None: NSS['svg']})
+
+    nsmap = {None: NSS['svg'], 'inkscape': NSS['inkscape'],
+             'xlink': NSS['xlink']}
+    with etree.xmlfile(output, encoding='utf-8') as xf:
+        xf.write_declaration()
+        with xf.element(addNS('svg', 'svg'), nsmap=nsmap,
+                        width='%s%s' % (width, units),
+                        height='%s%s' % (height, units),
+                        viewBox='%s %s %s %s' % (x, y, width, height),
+                        version='1.1'):
+            attrib = {addNS('label', 'inkscape'): 'hexmap',
+                      addNS('groupmode', 'inkscape'): 'layer'}
+            if map_spec['clip']:
+                attrib['clip-path'] = define_clip(defs, layout)
+            with xf.element(addNS('g', 'svg'), attrib):
+                for element in draw(layout, map_spec, defs):
+                    xf.write(element)
+            output_styles.define(defs)
+            # Symbols and patterns are only known once the map is drawn
+            if len(defs):
+                xf.write(defs)
+
+# -------------------------------------------------------------------------
+# Layer creation and management
+# -------------------------------------------------------------------------
+
+def append_if_new_name(svg, layer):
+    """
+    Append the layer unless there is already one with its name.
+    Returns the layer that is in the document.
+    """
+    if layer is not None:
+        name = layer.get(addNS('label', 'inkscape'))
+        for c in svg.iterchildren():
+            if c.get(addNS('label', 'inkscape'), 'name') == name:
+                return c
+        svg.append(layer)
+    return layer
+
+def local_name(element):
+    """
+    The tag of an element without its namespace. New elements are drawn
+    without one but an SVG document read back puts them in the SVG
+    namespace.
+    """
+    return element.tag.rpartition('}')[2]
+
+def same_element(a, b):
+    """
+    Do two elements have the same content?
+    """
+    return (local_name(a) == local_name(b) and a.text == b.text
+            and a.attrib == b.attrib
+            and len(a) == len(b)
+            and all(same_element(x, y) for (x, y) in zip(a, b)))
+
+def update_children(parent, elements):
+    """
+    Make the children of parent match the new elements, keeping every
+    existing child with the same id and content. Children that only
+    differ in their own children are updated the same way.
+    Returns the number of children (added, changed, removed).
+    """
+    existing = {}
+    for child in parent.iterchildren():
+        if child.get('id') is not None:
+            existing[child.get('id')] = child
+
+    (added, changed) = (0, 0)
+    previous = None
+    for element in elements:
+        current = existing.pop(element.get('id'), None)
+        if current is None or local_name(current) != local_name(element):
+            added += 1
+        elif same_element(current, element):
+            element = current
+        elif current.text == element.text and current.attrib == element.attrib:
+            counts = update_children(current, list(element))
+            element = current
+            changed += 1 if any(counts) else 0
+        else:
+            parent.replace(current, element)
+            changed += 1
+
+        # Move the element into place after the previous one
+        if previous is None:
+            following = parent[0] if len(parent) else None
+        else:
+            following = previous.getnext()
+        if following is not element:
+            if previous is None:
+                parent.insert(0, element)
+            else:
+                previous.addnext(element)
+        previous = element
+
+    # Whatever is left after the last element was replaced or removed
+    stale = (list(parent) if previous is None
+             else list(previous.itersiblings()))
+    for child in stale:
+        parent.remove(child)
+    return (added, changed, len(stale))
+
+def find_or_create_defs(svg):
+    defs = svg.find(addNS('defs', 'svg'))
+    if defs is None:
+        defs = etree.Element(addNS('defs', 'svg'))
+        svg.insert(0, defs)
+    return defs
+
+def define_clip(defs, layout, clip_id='hexmap-clip'):
+    """
+    Define a clip path of the layout viewport, replacing any old one.
+    Returns the value of the clip-path attribute that uses it.
+    """
+    for old in defs.iterchildren():
+        if old.get('id') == clip_id:
+            defs.remove(old)
+    clip = etree.SubElement(defs, addNS('clipPath', 'svg'))
+    clip.set('id', clip_id)
+    (x0, y0, x1, y1) = layout.viewport
+    rect = etree.SubElement(clip, addNS('rect', 'svg'))
+    rect.set('x', output_format.number(x0))
+    rect.set('y', output_format.number(y0))
+    rect.set('width', output_format.number(x1 - x0))
+    rect.set('height', output_format.number(y1 - y0))
+    return 'url(#%s)' % clip_id
+
+def createLayer(name, nsmap=None):
+    layer = etree.Element(addNS('g', 'svg'), nsmap=nsmap)
+    layer.set(addNS('label', 'inkscape'), name)
+    layer.set(addNS('groupmode', 'inkscape'), 'layer')
+    return layer